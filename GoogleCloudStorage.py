@@ -1,18 +1,76 @@
+import base64
+import glob
+import hashlib
+import json
 import logging
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 from google.cloud import storage
 
+import metrics
+
+try:
+    import google_crc32c
+except ImportError:  # downloads are checked against the MD5 hash instead
+    google_crc32c = None
+
+try:
+    import fcntl
+except ImportError:  # Windows, where the cache is not shared between processes
+    fcntl = None
+
 logger = logging.getLogger(__name__)
 
+# Size of the ranges fetched by parallel downloads
+CHUNK_SIZE = 32 * 1024 * 1024
+
+# Default disk budget of a BlobCache
+CACHE_SIZE = 50 * 1024 * 1024 * 1024
+
 
 class GoogleCloudStorageBucket:
-    def __init__(self, bucket: str):
+    def __init__(self, bucket: str, cache: "BlobCache" = None):
+        """Connection to a Google Cloud Storage bucket
+
+        Args:
+            bucket (str): name of the bucket
+            cache (BlobCache, optional): local cache used by fetch()
+        """
         self.client = storage.Client()
         self.bucket = self.client.get_bucket(bucket)
         self.bucket_name = bucket
+        self.cache = cache
+
+    def download(
+        self,
+        remote: str,
+        local: str = None,
+        overwrite: bool = False,
+        workers: int = 1,
+        chunk_size: int = CHUNK_SIZE,
+    ):
+        """Download a blob to a local file
 
-    def download(self, remote: str, local: str = None, overwrite: bool = False):
+        With more than one worker, blobs larger than chunk_size are split into
+        ranges that are fetched concurrently into a preallocated
+        "{local}.part" file. Completed ranges are recorded alongside it so an
+        interrupted download resumes with only the missing ranges. The result
+        is verified against the blob's CRC32C (or MD5) before being moved into
+        place.
+
+        Args:
+            remote (str): name of the blob in the bucket
+            local (str, optional): destination path. Defaults to the blob's
+                basename in the working directory. A trailing "/" places the
+                blob's basename in that directory.
+            overwrite (bool): replace an existing local file
+            workers (int): number of ranges fetched concurrently
+            chunk_size (int): size in bytes of each range
+        """
         if not local:
             local = os.path.basename(remote)
 
@@ -32,9 +90,168 @@ class GoogleCloudStorageBucket:
             raise FileNotFoundError(f"{remote} not found")
 
         logger.info(f"Downloading gs://{self.bucket_name}/{remote} to {local}")
-        blob.download_to_filename(local)
+        self._download_blob(blob, local, workers, chunk_size)
         return local
 
+    def fetch(self, remote: str, workers: int = 1, revalidate: bool = True):
+        """Local path to a blob, downloading it into the cache when missing
+
+        Args:
+            remote (str): name of the blob in the bucket
+            workers (int): number of ranges fetched concurrently on a miss
+            revalidate (bool): look up the blob's current generation in the
+                bucket. If False, any cached generation is returned without
+                contacting GCS.
+        """
+        if self.cache is None:
+            raise ValueError("fetch requires a bucket created with a cache")
+
+        if not revalidate:
+            path = self.cache.get(self.bucket_name, remote)
+            if path:
+                return path
+
+        blob = self._get_blob(remote)
+        path = self.cache.get(self.bucket_name, remote, blob.generation)
+        if path:
+            logger.info(f"Using cached gs://{self.bucket_name}/{remote} at {path}")
+            return path
+
+        logger.info(f"Caching gs://{self.bucket_name}/{remote}")
+        return self.cache.put(
+            self.bucket_name,
+            remote,
+            blob.generation,
+            lambda local: self._download_blob(blob, local, workers, CHUNK_SIZE),
+        )
+
+    def _download_blob(self, blob, local: str, workers: int, chunk_size: int):
+        if workers > 1 and blob.size > chunk_size:
+            self._download_chunked(blob, local, workers, chunk_size)
+        else:
+            blob.download_to_filename(local)
+            _count(blob.size)
+
+    def _download_chunked(self, blob, local: str, workers: int, chunk_size: int):
+        part = local + ".part"
+        state_path = part + ".json"
+        state = {
+            "generation": blob.generation,
+            "size": blob.size,
+            "chunk_size": chunk_size,
+            "done": [],
+        }
+
+        try:
+            with open(state_path) as f:
+                previous = json.load(f)
+        except (FileNotFoundError, ValueError):
+            previous = None
+
+        if (
+            previous
+            and os.path.exists(part)
+            and all(
+                previous.get(k) == state[k]
+                for k in ("generation", "size", "chunk_size")
+            )
+        ):
+            state["done"] = previous["done"]
+            logger.info(f"Resuming {part}, {len(state['done'])} chunks already done")
+        else:
+            with open(part, "wb") as f:
+                f.truncate(blob.size)
+
+        done = set(state["done"])
+        chunks = [i for i in range(-(-blob.size // chunk_size)) if i not in done]
+        lock = threading.Lock()
+
+        def fetch(i):
+            start = i * chunk_size
+            end = min(start + chunk_size, blob.size) - 1
+            data = blob.download_as_bytes(
+                start=start, end=end, if_generation_match=blob.generation
+            )
+            _count(len(data))
+            if len(data) != end - start + 1:
+                raise IOError(f"Short read for bytes {start}-{end} of {blob.name}")
+            with open(part, "r+b") as f:
+                f.seek(start)
+                f.write(data)
+            with lock:
+                state["done"].append(i)
+                with open(state_path + ".tmp", "w") as f:
+                    json.dump(state, f)
+                os.replace(state_path + ".tmp", state_path)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for _ in pool.map(metrics.bind(fetch), chunks):
+                pass
+
+        if not _verify(blob, part):
+            os.remove(part)
+            os.remove(state_path)
+            raise IOError(f"Checksum mismatch downloading {blob.name}")
+
+        os.replace(part, local)
+        os.remove(state_path)
+
+    def _get_blob(self, remote: str):
+        blob = self.bucket.get_blob(remote)
+        if not blob:
+            raise FileNotFoundError(f"{remote} not found")
+        return blob
+
+    def read(self, remote: str) -> bytes:
+        """Contents of a blob, downloaded into memory without a local file
+
+        The bytes can be passed straight to a decoder, e.g. arl.ARLFile.
+        """
+        blob = self._get_blob(remote)
+        logger.info(f"Reading gs://{self.bucket_name}/{remote} into memory")
+        data = blob.download_as_bytes(if_generation_match=blob.generation)
+        _count(len(data))
+        if len(data) != blob.size:
+            raise IOError(f"Short read of {blob.name}")
+        return data
+
+    def read_range(
+        self, remote: str, start: int, end: int, generation: int = None
+    ) -> bytes:
+        """Read bytes [start, end) of a blob without downloading the rest
+
+        The read is pinned to a generation of the blob, so a blob that is
+        being rewritten raises rather than returning bytes of another version.
+        Pass the same generation, e.g. from ls(), to keep several reads of a
+        blob consistent, or read them through open().
+
+        Args:
+            remote (str): name of the blob in the bucket
+            start (int): first byte to read
+            end (int): byte after the last one to read
+            generation (int, optional): generation the blob must have.
+                Defaults to its current generation.
+        """
+        logger.debug(f"Reading bytes {start}-{end} of gs://{self.bucket_name}/{remote}")
+        if generation is None:
+            generation = self._get_blob(remote).generation
+        blob = self.bucket.blob(remote)
+        data = blob.download_as_bytes(
+            start=start, end=end - 1, if_generation_match=generation
+        )
+        _count(len(data))
+        return data
+
+    def open(self, remote: str, workers: int = 8):
+        """Open a blob for random access reads using HTTP range requests
+
+        Args:
+            remote (str): name of the blob in the bucket
+            workers (int): number of ranges fetched concurrently by
+                BlobRangeReader.read_ranges
+        """
+        return BlobRangeReader(self._get_blob(remote), workers=workers)
+
     def upload(self, local: str, remote: str = None):
         if not os.path.exists(local):
             raise FileNotFoundError(f"{local} not found")
@@ -49,10 +266,233 @@ class GoogleCloudStorageBucket:
         blob = self.bucket.blob(remote)
         blob.upload_from_filename(local)
 
-    def ls(self, prefix: str = None):
-        blobs = self.client.list_blobs(self.bucket, prefix=prefix)
+    def ls(self, prefix: str = None, fields: str = None):
+        """Blobs under a prefix
+
+        Args:
+            prefix (str, optional): only list blob names starting with prefix
+            fields (str, optional): partial response selector limiting the
+                metadata returned, e.g. "items(name,generation)". The token of
+                the next page is always requested, so listings aren't cut off
+                after the first page.
+        """
+        if fields and "nextPageToken" not in fields:
+            fields += ",nextPageToken"
+        blobs = self.client.list_blobs(self.bucket, prefix=prefix, fields=fields)
         return [blob for blob in blobs]
 
     def exists(self, filename: str):
         blob = self.bucket.blob(filename)
         return blob.exists()
+
+
+def _count(size: int):
+    """Record a download in the active metrics.Run"""
+    metrics.add("gcs_requests")
+    metrics.add("gcs_bytes", size)
+
+
+def _verify(blob, path: str) -> bool:
+    """Compare a local file against the blob's CRC32C, or MD5 if unavailable"""
+    if blob.crc32c and google_crc32c is not None:
+        checksum = google_crc32c.Checksum()
+        expected = base64.b64decode(blob.crc32c)
+    elif blob.md5_hash:
+        checksum = hashlib.md5()
+        expected = base64.b64decode(blob.md5_hash)
+    else:
+        logger.warning(f"No checksum available for {blob.name}, skipping check")
+        return True
+
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(CHUNK_SIZE), b""):
+            checksum.update(data)
+    return checksum.digest() == expected
+
+
+class BlobRangeReader:
+    def __init__(self, blob, workers: int = 8):
+        """Read-only, seekable file-like access to a blob using range requests
+
+        Reads are pinned to the generation of the blob at the time it was
+        opened, so a blob that is replaced mid-read raises rather than
+        returning a mix of old and new bytes.
+
+        Args:
+            blob (google.cloud.storage.Blob): blob with loaded metadata
+            workers (int): number of ranges fetched concurrently by read_ranges
+        """
+        self.blob = blob
+        self.size = blob.size
+        self.workers = workers
+        self._position = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        pass
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        self._position = max(offset, 0)
+        return self._position
+
+    def _fetch(self, start: int, end: int) -> bytes:
+        end = min(end, self.size)
+        if start >= end:
+            return b""
+        data = self.blob.download_as_bytes(
+            start=start, end=end - 1, if_generation_match=self.blob.generation
+        )
+        _count(len(data))
+        return data
+
+    def read(self, size: int = -1) -> bytes:
+        end = self.size if size is None or size < 0 else self._position + size
+        data = self._fetch(self._position, end)
+        self._position += len(data)
+        return data
+
+    def read_ranges(self, ranges):
+        """Fetch several (offset, size) ranges concurrently
+
+        Returns:
+            list of bytes: data for each range, in the order requested
+        """
+        if len(ranges) == 1:
+            offset, size = ranges[0]
+            return [self._fetch(offset, offset + size)]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            fetch = metrics.bind(lambda r: self._fetch(r[0], r[0] + r[1]))
+            return list(pool.map(fetch, ranges))
+
+
+class BlobCache:
+    def __init__(self, path: str, max_bytes: int = CACHE_SIZE):
+        """Local, size-bounded cache of blobs shared between processes
+
+        Entries are keyed by bucket, blob name and generation, so a blob that
+        is rewritten in GCS gets a new entry. Blobs are downloaded to a
+        temporary file and atomically renamed into place, and the least
+        recently used entries are evicted once the cache exceeds max_bytes.
+
+        Args:
+            path (str): cache directory
+            max_bytes (int): disk budget in bytes
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(path, ".locks"), exist_ok=True)
+
+    def _prefix(self, bucket: str, name: str):
+        key = hashlib.sha256(f"{bucket}/{name}".encode()).hexdigest()[:32]
+        return os.path.join(self.path, key)
+
+    def get(self, bucket: str, name: str, generation: int = None):
+        """Path to a cached blob, or None if it is not cached
+
+        Args:
+            bucket (str): bucket name
+            name (str): blob name
+            generation (int, optional): blob generation. Defaults to the
+                newest cached generation.
+        """
+        prefix = self._prefix(bucket, name)
+        if generation is not None:
+            path = f"{prefix}.{generation}"
+        else:
+            cached = [
+                p for p in glob.glob(f"{prefix}.*") if p.rsplit(".", 1)[1].isdigit()
+            ]
+            if not cached:
+                return None
+            path = max(cached, key=lambda p: int(p.rsplit(".", 1)[1]))
+
+        try:
+            # Mark the entry as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    @contextmanager
+    def _lock(self, name: str):
+        with open(os.path.join(self.path, ".locks", name), "a") as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def put(self, bucket: str, name: str, generation: int, download):
+        """Add a blob to the cache
+
+        Only one process downloads a given entry at a time; others wait and
+        then use the published file.
+
+        Args:
+            bucket (str): bucket name
+            name (str): blob name
+            generation (int): blob generation
+            download (callable): called with a temporary path to write the blob
+                to
+
+        Returns:
+            str: path to the cached blob
+        """
+        path = f"{self._prefix(bucket, name)}.{generation}"
+        with self._lock(os.path.basename(path)):
+            if not os.path.exists(path):
+                # Temporary files are hidden from eviction and readers until
+                # the rename publishes the complete blob
+                tmp = os.path.join(self.path, "." + os.path.basename(path) + ".tmp")
+                download(tmp)
+                os.replace(tmp, path)
+        self.evict(keep=path)
+        return self.get(bucket, name, generation) or path
+
+    def evict(self, keep: str = None):
+        """Remove least recently used entries until within the disk budget
+
+        Temporary files left behind by interrupted downloads are removed once
+        they are more than a day old.
+        """
+        with self._lock("evict"):
+            entries = []
+            for entry in os.scandir(self.path):
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                if entry.name.startswith("."):
+                    if time.time() - stat.st_mtime > 24 * 60 * 60:
+                        os.remove(entry.path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                logger.info(f"Evicting {path} from blob cache")
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
@@ -1,9 +1,17 @@
+import asyncio
+import hashlib
+import io
+import json
 import os
-from datetime import datetime
-from math import asin, cos, radians, sin, sqrt
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 
 import numpy as np
-import requests
+from urllib.parse import parse_qsl, urlsplit
+
+import metrics
 
 default_vars = (
     "altimeter,"
@@ -26,36 +34,469 @@ carslaw_vars = (
 """TAMMY'S API TOKEN!!! If using a lot, please request your own.
 Get your own token here: https://developers.synopticdata.com/"""
 MESOWEST_TOKEN = os.getenv("MESOWEST_TOKEN")
-if not MESOWEST_TOKEN:
-    raise EnvironmentError("MESOWEST_TOKEN environment variable not found.")
+
+
+def get_token():
+    """
+    MesoWest API token, checked when the first request is built rather than
+    on import, so that importing this module never requires credentials.
+    """
+    token = MESOWEST_TOKEN or os.getenv("MESOWEST_TOKEN")
+    if not token:
+        raise EnvironmentError("MESOWEST_TOKEN environment variable not found.")
+    return token
+
+
+# Directory of the on-disk response cache. Caching is disabled if not set.
+MESOWEST_CACHE_DIR = os.getenv("MESOWEST_CACHE_DIR")
+
+
+# Radius of earth in kilometers
+EARTH_RADIUS = 6371
 
 
 def dist(lat1, long1, lat2, long2):
-    """Replicating the same formula as mentioned in Wiki"""
+    """
+    Replicating the same formula as mentioned in Wiki
+    Great circle distance in km with the haversine formula. The arguments
+    can be scalars or NumPy arrays, and are broadcast against each other.
+    """
     # convert decimal degrees to radians
-    lat1, long1, lat2, long2 = map(radians, [lat1, long1, lat2, long2])
+    lat1, long1, lat2, long2 = map(np.radians, [lat1, long1, lat2, long2])
     # haversine formula
     dlon = long2 - long1
     dlat = lat2 - lat1
-    a = sin(dlat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dlon / 2) ** 2
-    c = 2 * asin(sqrt(a))
-    # Radius of earth in kilometers is 6371
-    km = 6371 * c
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    c = 2 * np.arcsin(np.sqrt(np.minimum(a, 1)))
+    km = EARTH_RADIUS * c
     return km
 
 
-def find_nearest(lat, long):
-    distances = df.apply(lambda row: dist(lat, long, row["LAT"], row["LON"]), axis=1)
-    return distances  # df.loc[distances.idxmin(), 'STID']
+def _unit_vectors(lat, lon):
+    lat = np.radians(np.asarray(lat, dtype=float))
+    lon = np.radians(np.asarray(lon, dtype=float))
+    return np.stack(
+        [np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1
+    )
+
+
+def _chord(km):
+    """Straight line distance through the unit sphere of a great circle distance"""
+    return 2 * np.sin(np.minimum(np.asarray(km, dtype=float) / EARTH_RADIUS, np.pi) / 2)
+
+
+class StationIndex:
+    def __init__(self, lat, lon):
+        """
+        Spatial index of station locations.
+        Stations are stored as points on the unit sphere in a KD-tree. The
+        straight line distance between two points increases with the great
+        circle distance, so nearest and within-radius queries on the tree
+        give the same stations as the haversine metric, and are answered
+        for a whole array of points at once.
+        Input:
+            lat - Array of station latitudes in degrees
+            lon - Array of station longitudes in degrees
+        """
+        self.lat = np.asarray(lat, dtype=float)
+        self.lon = np.asarray(lon, dtype=float)
+        from scipy.spatial import cKDTree
+
+        self.tree = cKDTree(_unit_vectors(self.lat, self.lon))
+
+    def __len__(self):
+        return len(self.lat)
+
+    def nearest(self, lat, lon, k=1, max_distance=np.inf):
+        """
+        Find the k nearest stations to each point.
+        Input:
+            lat          - Latitude(s) of the points in degrees
+            lon          - Longitude(s) of the points in degrees
+            k            - Number of stations to find for each point
+            max_distance - Only return stations closer than this, in km
+        Output:
+            (distance, index) arrays of shape (..., k), or (...) if k is 1.
+            distance is in km, and index is the position of the station in
+            the index. Missing neighbors have an infinite distance and an
+            index of len(self).
+        """
+        chord, index = self.tree.query(
+            _unit_vectors(lat, lon),
+            k=k,
+            distance_upper_bound=_chord(max_distance)
+            if np.isfinite(max_distance)
+            else np.inf,
+        )
+        distance = 2 * EARTH_RADIUS * np.arcsin(np.minimum(chord / 2, 1))
+        distance = np.where(np.isinf(chord), np.inf, distance)
+        return distance, index
+
+    def within(self, lat, lon, radius):
+        """
+        Find the stations within a radius of each point.
+        Input:
+            lat    - Latitude(s) of the points in degrees
+            lon    - Longitude(s) of the points in degrees
+            radius - Distance from the points in km
+        Output:
+            For a single point, a list of station indexes. For an array of
+            points, an object array holding a list for each point.
+        """
+        return self.tree.query_ball_point(
+            _unit_vectors(lat, lon), _chord(radius), return_sorted=True
+        )
+
+
+def find_nearest(lat, long, df):
+    """
+    Find the nearest station to a point or array of points.
+    Input:
+        lat  - Latitude(s) of the points in degrees
+        long - Longitude(s) of the points in degrees
+        df   - Stations with LAT, LON and STID columns, i.e. a DataFrame or
+               the dictionary returned by get_mesowest_radius
+    Output:
+        STID of the nearest station to each point
+    """
+    index = StationIndex(df["LAT"], df["LON"])
+    _, nearest = index.nearest(lat, long)
+    return np.asarray(df["STID"])[nearest]
+
+
+def _decompress(body, encoding):
+    """Decode a response body sent with a gzip or deflate Content-Encoding"""
+    encoding = (encoding or "").strip().lower()
+    if encoding == "gzip":
+        return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        # Servers send deflate both with and without the zlib header
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    return body
+
+
+class MesoWestClient:
+    def __init__(self, timeout=(10, 120), retries=5, backoff=1.0, pool_size=16):
+        """
+        HTTP client for the MesoWest API.
+        Keeps a pool of keep-alive connections and retries failed requests
+        with exponential backoff, honoring the Retry-After header of rate
+        limited (HTTP 429) responses.
+        Input:
+            timeout   - (connect, read) timeouts in seconds
+            retries   - Number of times a failed request is retried
+            backoff   - Backoff factor in seconds. Retries wait backoff * 2^n
+            pool_size - Number of connections kept open, and the number of
+                        requests get_many sends at once
+        """
+        # Imported here so that modules importing this one for parsing or
+        # station indexing don't pay for the HTTP stack
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        self.timeout = timeout
+        self.pool_size = pool_size
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=("GET",),
+            respect_retry_after_header=True,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Accept-Encoding"] = "gzip, deflate"
+        self._executor = None
+
+    def get(self, URL, verbose=True):
+        """Return json data as a dictionary from a URL"""
+        if verbose:
+            print("\nRetrieving from MesoWest API: %s\n" % URL)
+
+        # The body is read as sent, so that the bytes counted are the bytes
+        # transferred rather than the decompressed JSON
+        f = self.session.get(URL, timeout=self.timeout, stream=True)
+        try:
+            body = f.raw.read(decode_content=False)
+        finally:
+            f.close()
+        metrics.add("mesowest_requests")
+        metrics.add("mesowest_bytes", len(body))
+        f.raise_for_status()
+        return json.loads(_decompress(body, f.headers.get("Content-Encoding")))
+
+    def _pool(self):
+        """Threads sending the requests of get_async and get_many"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.pool_size)
+        return self._executor
+
+    async def get_async(self, URL, verbose=True):
+        """Awaitable version of get, run on the client's connection pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._pool(), metrics.bind(self.get), URL, verbose
+        )
+
+    async def get_many_async(self, URLs, verbose=True):
+        """Fetch several URLs at once, returning their json data in order"""
+        return await asyncio.gather(*(self.get_async(URL, verbose) for URL in URLs))
+
+    def get_many(self, URLs, verbose=True):
+        """
+        Blocking version of get_many_async.
+        The requests are sent from the client's threads rather than an event
+        loop, so this also works where a loop is already running, e.g. Jupyter.
+        """
+        get = metrics.bind(lambda URL: self.get(URL, verbose))
+        return list(self._pool().map(get, URLs))
+
+
+_client = None
+
+
+def get_client():
+    """Shared MesoWestClient used by the functions in this module"""
+    global _client
+    if _client is None:
+        _client = MesoWestClient()
+    return _client
 
 
 def load_json(URL, verbose=True):
     """Return json data as a dictionary from a URL"""
-    if verbose:
-        print("\nRetrieving from MesoWest API: %s\n" % URL)
+    return get_client().get(URL, verbose=verbose)
+
+
+class ResponseCache:
+    def __init__(self, path, settle=3 * 24 * 3600, ttl=3600):
+        """
+        On-disk cache of parsed MesoWest API responses.
+        Entries are keyed by the normalized query parameters of the request
+        URL, excluding the API token, and by the options the response was
+        parsed with, e.g. set_num, and stored as compressed numpy arrays.
+        Observations can still be added or corrected shortly after they are
+        made, so entries fetched less than settle seconds after the requested
+        time expire after ttl seconds. Older entries are kept permanently.
+        Input:
+            path   - Cache directory
+            settle - Seconds after which the requested data no longer changes
+            ttl    - Seconds that entries for more recent data are valid for
+        """
+        self.path = path
+        self.settle = settle
+        self.ttl = ttl
+        os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def _params(URL):
+        query = parse_qsl(urlsplit(URL).query)
+        return sorted((k.lower(), v) for k, v in query if k.lower() != "token")
+
+    def _file(self, URL, options):
+        key = json.dumps(
+            [urlsplit(URL).path, self._params(URL), sorted(options.items())]
+        )
+        return os.path.join(
+            self.path, hashlib.sha256(key.encode()).hexdigest() + ".npz"
+        )
+
+    def _data_time(self, URL):
+        """Requested time of a query, as seconds since the epoch"""
+        params = dict(self._params(URL))
+        stamp = params.get("attime") or params.get("end")
+        if not stamp:
+            return time.time()
+        date = datetime.strptime(stamp, "%Y%m%d%H%M").replace(tzinfo=timezone.utc)
+        return date.timestamp()
+
+    def get(self, URL, **options):
+        """
+        Cached result for a request URL, or None.
+        Input:
+            URL       - Request URL
+            **options - Options the response is parsed with, e.g. set_num.
+                        Results parsed with other options are not returned.
+        """
+        try:
+            with np.load(self._file(URL, options)) as npz:
+                meta = json.loads(str(npz["__meta__"]))
+                if (
+                    meta["fetched"] - meta["data_time"] < self.settle
+                    and time.time() - meta["fetched"] > self.ttl
+                ):
+                    return None
+                return_this = {}
+                for k, kind in meta["kinds"].items():
+                    value = npz[k]
+                    if kind == "scalar":
+                        value = value.item()
+                    elif kind == "list":
+                        value = value.tolist()
+                    if k in meta.get("utc", ()):
+                        value = _localize_utc(value)
+                    return_this[k] = value
+        except (FileNotFoundError, ValueError, KeyError, OSError):
+            return None
+        return_this["URL"] = URL
+        return return_this
+
+    def put(self, URL, return_this, **options):
+        """
+        Store the result for a request URL. The URL itself is not stored.
+        Input:
+            URL         - Request URL
+            return_this - Parsed result
+            **options   - Options the response was parsed with, see get
+        """
+        arrays = {}
+        kinds = {}
+        utc = []
+        for k, value in return_this.items():
+            if k == "URL":
+                continue
+            if isinstance(value, np.ndarray):
+                kinds[k] = "array"
+            elif isinstance(value, list):
+                kinds[k] = "list"
+            else:
+                kinds[k] = "scalar"
+            value = np.asarray(value)
+            if value.dtype == object:
+                # Datetimes. numpy has no time zones, so aware ones are stored
+                # as naive UTC and made aware again by get
+                dates = value.ravel().tolist()
+                if any(date.tzinfo for date in dates):
+                    utc.append(k)
+                    dates = [
+                        date.astimezone(timezone.utc).replace(tzinfo=None)
+                        for date in dates
+                    ]
+                value = np.array(dates, dtype="datetime64[us]").reshape(value.shape)
+            arrays[k] = value
+        meta = {
+            "fetched": time.time(),
+            "data_time": self._data_time(URL),
+            "kinds": kinds,
+            "utc": utc,
+        }
+        arrays["__meta__"] = np.array(json.dumps(meta))
+
+        f = io.BytesIO()
+        np.savez_compressed(f, **arrays)
+        path = self._file(URL, options)
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, "wb") as out:
+            out.write(f.getvalue())
+        os.replace(tmp, path)
+
+
+def _localize_utc(value):
+    """Make the naive UTC datetimes stored by ResponseCache.put aware again"""
+    if isinstance(value, np.ndarray):
+        # Arrays of aware datetimes were object arrays before being stored
+        return np.array(_localize_utc(value.tolist()), dtype=object)
+    if isinstance(value, list):
+        return [_localize_utc(v) for v in value]
+    return value.replace(tzinfo=timezone.utc)
+
+
+_cache = None
 
-    f = requests.get(URL)
-    return f.json()
+
+def get_cache():
+    """Shared ResponseCache in MESOWEST_CACHE_DIR, or None if not configured"""
+    global _cache
+    if _cache is None and MESOWEST_CACHE_DIR:
+        _cache = ResponseCache(MESOWEST_CACHE_DIR)
+    return _cache
+
+
+def _parse_time(date_time):
+    """Strip the trailing "Z" from a MesoWest UTC timestamp for numpy"""
+    return date_time[:-1] if date_time.endswith("Z") else date_time
+
+
+def parse_nearesttime(data, set_num=0, verbose=True):
+    """
+    Build columns from a MesoWest nearesttime API response in a single pass.
+    Input:
+        data      - Decoded JSON response from the nearesttime API
+        set_num   - Index of the sensor set to use for each variable, see
+                    get_mesowest_radius
+        verbose   - True: Print stations that are missing a variable
+                    False: Don't print anything
+    Output:
+        A dictionary of columns, one row per station:
+            NAME, STID          - string arrays
+            LAT, LON            - float64 arrays
+            ELEVATION           - float32 array, in feet. NaN if unknown.
+            <variable>          - float64 array of the observed value, NaN
+                                  if the station does not report it
+            <variable>_DATETIME - datetime64[s] array of the observation
+                                  time in UTC, NaT if not reported
+    """
+    stations = data["STATION"]
+    n = len(stations)
+    variables = [str(v) for v in data["UNITS"]]
+
+    names = [None] * n
+    stids = [None] * n
+    lat = np.empty(n, dtype=np.float64)
+    lon = np.empty(n, dtype=np.float64)
+    elevation = np.empty(n, dtype=np.float32)
+    values = {v: np.full(n, np.nan, dtype=np.float64) for v in variables}
+    times = {v: ["NaT"] * n for v in variables}
+
+    for i, stn in enumerate(stations):
+        # Store basic metadata for each station.
+        names[i] = str(stn["NAME"])
+        stids[i] = str(stn["STID"])
+        lat[i] = float(stn["LATITUDE"])
+        lon[i] = float(stn["LONGITUDE"])
+        try:
+            elevation[i] = int(stn["ELEVATION"])
+        except (KeyError, TypeError, ValueError):
+            elevation[i] = np.nan
+
+        # If a station does not have a variable, then its value stays NaN.
+        sensors = stn["SENSOR_VARIABLES"]
+        observations = stn["OBSERVATIONS"]
+        for v in variables:
+            sets = sensors.get(v)
+            if sets and len(observations) > 0:
+                if len(sets) == 1 and set_num == 0:
+                    grab_this_set = next(iter(sets))
+                else:
+                    grab_this_set = sorted(sets)[set_num]
+                observation = observations[grab_this_set]
+                values[v][i] = float(observation["value"])
+                times[v][i] = _parse_time(observation["date_time"])
+            elif verbose:
+                print("%s is not available for %s" % (v, stn["STID"]))
+
+    return_this = {
+        "NAME": np.array(names, dtype=str),
+        "STID": np.array(stids, dtype=str),
+        "LAT": lat,
+        "LON": lon,
+        "ELEVATION": elevation,  # Elevation is in feet.
+    }
+    for v in variables:
+        return_this[v] = values[v]
+        # Since some observation times for each variables at the same station
+        # *could* be different, the datetimes from each variable are stored
+        # with a similar name as the variable.
+        return_this[v + "_DATETIME"] = np.array(times[v], dtype="datetime64[s]")
+    return return_this
 
 
 def get_mesowest_ts(
@@ -99,7 +540,7 @@ def get_mesowest_ts(
     URL = (
         "http://api.mesowest.net/v2/stations/timeseries?"
         + "&token="
-        + MESOWEST_TOKEN
+        + get_token()
         + "&stid="
         + stationID
         + "&start="
@@ -113,6 +554,12 @@ def get_mesowest_ts(
         + "&output=json"
     )
 
+    cache = get_cache()
+    if cache:
+        cached = cache.get(URL, set_num=set_num)
+        if cached is not None:
+            return cached
+
     ## Open URL, and convert JSON to some python-readable format.
     data = load_json(URL, verbose=verbose)
 
@@ -158,8 +605,10 @@ def get_mesowest_ts(
                 if verbose:
                     print("    Used %s" % grab_this_set)
                 variable_data = stn["OBSERVATIONS"][grab_this_set]
-                return_this[key_name] = np.array(variable_data, dtype=np.float)
+                return_this[key_name] = np.array(variable_data, dtype=float)
 
+        if cache:
+            cache.put(URL, return_this, set_num=set_num)
         return return_this
 
     else:
@@ -214,7 +663,8 @@ def get_mesowest_radius(
         verbose   - True: Print some diagnostics
                     False: Don't print anything
     Output:
-        A dictionary of data at each available station.
+        A dictionary of data at each available station, as typed columns with
+        one row per station. See parse_nearesttime.
     """
     ## Some basic checks
     assert isinstance(location, (str, type(None))), "location must be a string or None"
@@ -238,7 +688,7 @@ def get_mesowest_radius(
         URL = (
             "http://api.mesowest.net/v2/stations/nearesttime?"
             + "&token="
-            + MESOWEST_TOKEN
+            + get_token()
             + "&attime="
             + DATE.strftime("%Y%m%d%H%M")
             + "&within="
@@ -253,7 +703,7 @@ def get_mesowest_radius(
         URL = (
             "http://api.mesowest.net/v2/stations/nearesttime?"
             + "&token="
-            + MESOWEST_TOKEN
+            + get_token()
             + "&attime="
             + DATE.strftime("%Y%m%d%H%M")
             + "&within="
@@ -266,67 +716,21 @@ def get_mesowest_radius(
             + extra
         )
 
+    cache = get_cache()
+    if cache:
+        cached = cache.get(URL, set_num=set_num)
+        if cached is not None:
+            return cached
+
     ## Open URL, and convert JSON to some python-readable format.
     data = load_json(URL, verbose=verbose)
 
     if data["SUMMARY"]["RESPONSE_CODE"] == 1:
-        # Initiate a dictionary of the data we want to keep
-        return_this = {
-            "URL": URL,
-            "NAME": np.array([]),
-            "STID": np.array([]),
-            "LAT": np.array([]),
-            "LON": np.array([]),
-            "ELEVATION": np.array([]),  # Elevation is in feet.
-            "DATETIME": DATE,
-        }
-        #
-        # Create a new key for each possible variable
-        for v in data["UNITS"]:
-            return_this[str(v)] = np.array([])
-            # Since some observation times for each variables at the same station
-            # *could* be different, I will store the datetimes from each variable
-            # with a similar name as the variable.
-            return_this[str(v) + "_DATETIME"] = np.array([])
-        #
-        for stn in data["STATION"]:
-            # Store basic metadata for each station in the dictionary.
-            return_this["NAME"] = np.append(return_this["NAME"], str(stn["NAME"]))
-            return_this["STID"] = np.append(return_this["STID"], str(stn["STID"]))
-            return_this["LAT"] = np.append(return_this["LAT"], float(stn["LATITUDE"]))
-            return_this["LON"] = np.append(return_this["LON"], float(stn["LONGITUDE"]))
-            try:
-                return_this["ELEVATION"] = np.append(
-                    return_this["ELEVATION"], int(stn["ELEVATION"])
-                )
-            except:
-                return_this["ELEVATION"] = np.append(return_this["ELEVATION"], np.nan)
-            #
-            # Dynamically store data for all possible variable. If a station does
-            # not have a variable, then a np.nan will be it's value.
-            for v in data["UNITS"]:
-                if v in list(stn["SENSOR_VARIABLES"]) and len(stn["OBSERVATIONS"]) > 0:
-                    # If value exists, then append with the data
-                    grab_this_set = np.sort(list(stn["SENSOR_VARIABLES"][v]))[set_num]
-                    variable_data = float(stn["OBSERVATIONS"][grab_this_set]["value"])
-                    date_date = datetime.strptime(
-                        stn["OBSERVATIONS"][grab_this_set]["date_time"],
-                        "%Y-%m-%dT%H:%M:%SZ",
-                    )
-                    #
-                    return_this[v] = np.append(return_this[v], variable_data)
-                    return_this[v + "_DATETIME"] = np.append(
-                        return_this[v + "_DATETIME"], date_date
-                    )
-                else:
-                    if verbose:
-                        print("%s is not available for %s" % (v, stn["STID"]))
-                    # If value doesn't exist, then append with np.nan
-                    return_this[v] = np.append(return_this[v], np.nan)
-                    return_this[v + "_DATETIME"] = np.append(
-                        return_this[v + "_DATETIME"], np.nan
-                    )
-
+        return_this = parse_nearesttime(data, set_num=set_num, verbose=verbose)
+        return_this["URL"] = URL
+        return_this["DATETIME"] = DATE
+        if cache:
+            cache.put(URL, return_this, set_num=set_num)
         return return_this
 
     else:
@@ -335,3 +739,138 @@ def get_mesowest_radius(
             print("  !! Errors: %s" % URL)
             print("  !! Reason: %s\n" % data["SUMMARY"]["RESPONSE_MESSAGE"])
         return "ERROR"
+
+
+def bbox_tiles(bbox, tile_size=5.0):
+    """
+    Split a bounding box into tiles no larger than tile_size degrees.
+    Input:
+        bbox      - (lon_min, lat_min, lon_max, lat_max) in degrees
+        tile_size - Maximum width and height of each tile in degrees
+    Output:
+        A list of (lon_min, lat_min, lon_max, lat_max) tiles covering bbox.
+    """
+    lon_min, lat_min, lon_max, lat_max = bbox
+    assert lon_min < lon_max and lat_min < lat_max, "bbox must be (W, S, E, N)"
+    nx = int(np.ceil((lon_max - lon_min) / tile_size))
+    ny = int(np.ceil((lat_max - lat_min) / tile_size))
+    lons = np.linspace(lon_min, lon_max, nx + 1)
+    lats = np.linspace(lat_min, lat_max, ny + 1)
+    return [
+        (float(lons[i]), float(lats[j]), float(lons[i + 1]), float(lats[j + 1]))
+        for j in range(ny)
+        for i in range(nx)
+    ]
+
+
+def concat_stations(parts):
+    """
+    Combine station columns from parse_nearesttime, dropping duplicate STIDs.
+    Variables missing from some of the parts are filled with NaN (values)
+    or NaT (datetimes). The first occurrence of each station is kept.
+    """
+    keys = []
+    for part in parts:
+        keys += [k for k in part if k not in keys and k not in ("URL", "DATETIME")]
+
+    columns = {}
+    for k in keys:
+        arrays = []
+        for part in parts:
+            if k in part:
+                arrays.append(part[k])
+            elif k.endswith("_DATETIME"):
+                arrays.append(np.full(len(part["STID"]), "NaT", "datetime64[s]"))
+            else:
+                arrays.append(np.full(len(part["STID"]), np.nan))
+        columns[k] = np.concatenate(arrays) if arrays else np.array([])
+
+    _, first = np.unique(columns["STID"], return_index=True)
+    first.sort()
+    return {k: v[first] for k, v in columns.items()}
+
+
+def get_mesowest_bbox(
+    DATE,
+    bbox,
+    within=30,
+    variables=hrrr_vars,
+    extra="",
+    set_num=0,
+    tile_size=5.0,
+    verbose=True,
+):
+    """
+    Get MesoWest stations within a bounding box
+    Large boxes are split into tiles small enough to stay under the API
+    response limits. The tiles are requested concurrently and stations on
+    tile borders, which are returned by more than one tile, are kept once.
+    Input:
+        DATE      - datetime object of the time of interest in UTC
+        bbox      - (lon_min, lat_min, lon_max, lat_max) in degrees, e.g. the
+                    HRRR SLC subset is (-112.6, 40.0, -111.4, 41.3)
+        within    - *MINUTES*, plus or minus, the DATE to get for.
+        variables - String of variables you want to request from the MesoWest
+                    API, separated by commas.
+        extra     - Any extra conditions or filters, see get_mesowest_radius
+        set_num   - Index of the sensor set to use, see get_mesowest_radius
+        tile_size - Maximum width and height of each request in degrees
+        verbose   - True: Print some diagnostics
+                    False: Don't print anything
+    Output:
+        A dictionary of data at each available station, in the same format
+        as get_mesowest_radius, or "ERROR" if any tile failed.
+    """
+    assert isinstance(DATE, datetime), "DATE must be a datetime"
+    assert set_num >= 0 and isinstance(
+        set_num, int
+    ), "set_num must be a positive integer"
+
+    URLs = [
+        "http://api.mesowest.net/v2/stations/nearesttime?"
+        + "&token="
+        + get_token()
+        + "&attime="
+        + DATE.strftime("%Y%m%d%H%M")
+        + "&within="
+        + str(within)
+        + "&bbox="
+        + "%.4f,%.4f,%.4f,%.4f" % tile
+        + "&obtimezone=UTC"
+        + "&vars="
+        + variables
+        + extra
+        for tile in bbox_tiles(bbox, tile_size)
+    ]
+
+    ## Use cached tiles, and request every other tile at once
+    cache = get_cache()
+    parts = [cache.get(URL, set_num=set_num) if cache else None for URL in URLs]
+    missing = [URL for URL, part in zip(URLs, parts) if part is None]
+    responses = dict(zip(missing, get_client().get_many(missing, verbose=verbose)))
+
+    for i, URL in enumerate(URLs):
+        if parts[i] is not None:
+            continue
+        data = responses[URL]
+        code = data["SUMMARY"]["RESPONSE_CODE"]
+        if code == 1:
+            parts[i] = parse_nearesttime(data, set_num=set_num, verbose=verbose)
+        elif code == 2:
+            # No stations in this tile
+            parts[i] = parse_nearesttime(
+                {"STATION": [], "UNITS": {}}, set_num=set_num, verbose=verbose
+            )
+        else:
+            # There were errors in the API request
+            if verbose:
+                print("  !! Errors: %s" % URL)
+                print("  !! Reason: %s\n" % data["SUMMARY"]["RESPONSE_MESSAGE"])
+            return "ERROR"
+        if cache:
+            cache.put(URL, parts[i], set_num=set_num)
+
+    return_this = concat_stations(parts)
+    return_this["URL"] = URLs
+    return_this["DATETIME"] = DATE
+    return return_this
@@ -0,0 +1,506 @@
+"""Reader for NOAA ARL packed meteorology files
+
+ARL files are a sequence of fixed length records. Each time period starts with
+an index record describing the grid and the variables available at each level,
+followed by one record per level and variable. Every record is a 50 byte ASCII
+label followed by nx * ny bytes of packed data, so the position of any record
+can be computed from the index alone and only the records that are needed have
+to be read and unpacked.
+"""
+import os
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+LABEL_LENGTH = 50
+HEADER_LENGTH = 108
+# Bytes read when opening a file, enough for the index record of most grids so
+# that remote files need a single request to parse it
+INDEX_READ = 8192
+EARTH_RADIUS = 6371.2  # km, matches HYSPLIT's map projection routines
+
+# Names of the horizontal wind components at the surface and aloft
+SURFACE_WIND = ("U10M", "V10M")
+UPPER_WIND = ("UWND", "VWND")
+
+
+def _parse_label(label: bytes):
+    """Parse the 50 byte ASCII label that prefixes every record"""
+    label = label.decode("ascii")
+    year = int(label[0:2])
+    return {
+        "time": datetime(
+            year + (2000 if year < 40 else 1900),
+            int(label[2:4]),
+            int(label[4:6]),
+            int(label[6:8]),
+        ),
+        "forecast": int(label[8:10]),
+        "level": int(label[10:12]),
+        "grid": label[12:14],
+        "variable": label[14:18],
+        "exponent": int(label[18:22]),
+        "precision": float(label[22:36]),
+        "initial": float(label[36:50]),
+    }
+
+
+class ARLGrid:
+    def __init__(self, params, nx: int, ny: int):
+        """Map projection and dimensions of an ARL grid
+
+        Args:
+            params (sequence): the 12 grid parameters from the index record;
+                pole lat/lon, reference lat/lon, grid size (km), orientation,
+                tangent latitude, sync x/y, sync lat/lon and a reserved field
+            nx (int): number of grid points in the x direction
+            ny (int): number of grid points in the y direction
+        """
+        self.params = tuple(float(p) for p in params)
+        self.nx = nx
+        self.ny = ny
+        (
+            self.pole_lat,
+            self.pole_lon,
+            self.ref_lat,
+            self.ref_lon,
+            self.size,
+            self.orientation,
+            self.tangent_lat,
+            self.sync_x,
+            self.sync_y,
+            self.sync_lat,
+            self.sync_lon,
+            _,
+        ) = self.params
+
+        if self.size == 0:
+            # Latitude-longitude grid. The pole position holds the lower left
+            # corner and the reference position holds the grid spacing.
+            return
+
+        if self.orientation != 0:
+            raise NotImplementedError("Rotated ARL grids are not supported")
+        if self.tangent_lat == 0:
+            raise NotImplementedError("Mercator ARL grids are not supported")
+
+        # Lambert conformal (or polar stereographic for a tangent latitude of
+        # +/-90) on a sphere, following Snyder (1987)
+        phi = np.deg2rad(self.tangent_lat)
+        self._n = np.sin(phi)
+        if abs(abs(self.tangent_lat) - 90) < 1e-6:
+            self._f = 2 / self._n
+        else:
+            self._f = np.cos(phi) * np.tan(np.pi / 4 + phi / 2) ** self._n / self._n
+
+        # Projected grid spacing is the true spacing at the reference latitude
+        # multiplied by the scale factor of the projection there
+        self._dx = self.size * self._scale(self.ref_lat)
+        self._x0, self._y0 = self._project(self.sync_lat, self.sync_lon)
+
+    @property
+    def key(self):
+        """Hashable definition of the grid, identical for identical grids"""
+        return (self.params, self.nx, self.ny)
+
+    def __eq__(self, other):
+        return isinstance(other, ARLGrid) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return f"<ARLGrid nx={self.nx} ny={self.ny} params={self.params}>"
+
+    def _rho(self, lat):
+        lat = np.deg2rad(lat)
+        return EARTH_RADIUS * self._f / np.tan(np.pi / 4 + lat / 2) ** self._n
+
+    def _scale(self, lat):
+        return self._n * self._rho(lat) / (EARTH_RADIUS * np.cos(np.deg2rad(lat)))
+
+    def _project(self, lat, lon):
+        dlon = np.mod(np.asarray(lon, dtype=float) - self.ref_lon + 180, 360) - 180
+        theta = self._n * np.deg2rad(dlon)
+        rho = self._rho(np.asarray(lat, dtype=float))
+        return rho * np.sin(theta), -rho * np.cos(theta)
+
+    def convergence(self, lon):
+        """Angle between the grid's y axis and true north, in degrees
+
+        Winds on projected grids are grid-relative: u and v run along the
+        grid's x and y axes. Rotating them by this angle gives the east and
+        north components,
+
+            u_earth = cos(angle) * u + sin(angle) * v
+            v_earth = -sin(angle) * u + cos(angle) * v
+
+        Args:
+            lon (array-like): longitudes in degrees
+
+        Returns:
+            array: angle at each longitude, zero on latitude-longitude grids
+        """
+        lon = np.asarray(lon, dtype=float)
+        if self.size == 0:
+            return np.zeros_like(lon)
+        dlon = np.mod(lon - self.ref_lon + 180, 360) - 180
+        return self._n * dlon
+
+    def xy(self, lat, lon):
+        """Fractional, zero based column and row indices of lat/lon points
+
+        Args:
+            lat (array-like): latitudes in degrees
+            lon (array-like): longitudes in degrees
+
+        Returns:
+            tuple of arrays: (column, row) positions on the grid. Rows increase
+                from south to north, matching the order of the packed data.
+        """
+        lat = np.asarray(lat, dtype=float)
+        lon = np.asarray(lon, dtype=float)
+        if self.size == 0:
+            x = np.mod(lon - self.pole_lon, 360) / self.ref_lon
+            y = (lat - self.pole_lat) / self.ref_lat
+            return x, y
+        x, y = self._project(lat, lon)
+        return (
+            (x - self._x0) / self._dx + self.sync_x - 1,
+            (y - self._y0) / self._dx + self.sync_y - 1,
+        )
+
+    def latlon(self, x=None, y=None):
+        """Latitude and longitude of grid positions
+
+        Args:
+            x (array-like, optional): zero based column positions. Defaults to
+                every grid point.
+            y (array-like, optional): zero based row positions, same shape as x
+
+        Returns:
+            tuple of arrays: (lat, lon) in degrees, with shape (ny, nx) when
+                x and y are not given
+        """
+        if x is None or y is None:
+            x, y = np.meshgrid(np.arange(self.nx), np.arange(self.ny))
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        if self.size == 0:
+            lat = self.pole_lat + y * self.ref_lat
+            lon = np.mod(self.pole_lon + x * self.ref_lon + 180, 360) - 180
+            return lat, lon
+
+        px = self._x0 + (x - self.sync_x + 1) * self._dx
+        py = self._y0 + (y - self.sync_y + 1) * self._dx
+        sign = np.sign(self._n)
+        rho = sign * np.hypot(px, py)
+        theta = np.arctan2(sign * px, -sign * py)
+        lat = np.rad2deg(
+            2 * np.arctan((EARTH_RADIUS * self._f / rho) ** (1 / self._n)) - np.pi / 2
+        )
+        lon = np.mod(self.ref_lon + np.rad2deg(theta / self._n) + 180, 360) - 180
+        return lat, lon
+
+
+def unpack(packed, nx: int, ny: int, exponent: int, initial: float, precision: float):
+    """Unpack the differentially packed bytes of a single ARL record
+
+    Each byte stores the difference from the previous value in the row, scaled
+    by 2 ** (7 - exponent). The first value of each row is the difference from
+    the first value of the previous row, starting from the initial value in
+    the record label.
+
+    Args:
+        packed (bytes-like): nx * ny bytes of packed data
+        nx (int): number of grid points in the x direction
+        ny (int): number of grid points in the y direction
+        exponent (int): packing exponent from the record label
+        initial (float): value of the first grid point from the record label
+        precision (float): values smaller than this are set to zero
+
+    Returns:
+        np.ndarray: float32 array of shape (ny, nx), south to north
+    """
+    data = np.frombuffer(packed, dtype=np.uint8, count=nx * ny).reshape(ny, nx)
+    values = (data - 127.0) / 2.0 ** (7 - exponent)
+    values[:, 0] = np.cumsum(values[:, 0]) + initial
+    np.cumsum(values, axis=1, out=values)
+    values[np.abs(values) < precision] = 0
+    return values.astype(np.float32)
+
+
+class ARLFile:
+    def __init__(self, source):
+        """Random access to the records of an ARL packed meteorology file
+
+        Only the index record of the first time period is read on open. Data
+        records are read and unpacked on request.
+
+        Args:
+            source (str, bytes-like or file-like): path to an ARL file, the
+                contents of one (e.g. from GoogleCloudStorageBucket.read), or
+                a binary file object supporting seek and read. Contents are
+                read through a memoryview without being copied. File objects
+                that also provide read_ranges([(offset, size), ...]), such as
+                GoogleCloudStorage.BlobRangeReader, have the records needed
+                for a request fetched together.
+        """
+        self._memory = None
+        self._owned = False
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            self._memory = memoryview(source).cast("B")
+            self._file = None
+            self.size = len(self._memory)
+        else:
+            if isinstance(source, (str, os.PathLike)):
+                self._file = open(source, "rb")
+                self._owned = True
+            else:
+                self._file = source
+            self._file.seek(0, os.SEEK_END)
+            self.size = self._file.tell()
+        self._parse_index(self._read(0, min(INDEX_READ, self.size)))
+        self._times = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._owned:
+            self._file.close()
+        if self._memory is not None:
+            self._memory.release()
+
+    def _read(self, offset: int, size: int) -> bytes:
+        if self._memory is not None:
+            return self._memory[offset : offset + size]
+        self._file.seek(offset)
+        return self._file.read(size)
+
+    def _read_many(self, ranges):
+        read_ranges = getattr(self._file, "read_ranges", None)
+        if read_ranges:
+            return read_ranges(ranges)
+        return [self._read(offset, size) for offset, size in ranges]
+
+    def _parse_index(self, record: bytes):
+        record = bytes(record)
+        label = _parse_label(record[:LABEL_LENGTH])
+        if label["variable"] != "INDX":
+            raise ValueError("Not an ARL file, first record is not an index record")
+
+        header = record[LABEL_LENGTH : LABEL_LENGTH + HEADER_LENGTH].decode("ascii")
+        self.source = header[0:4].strip()
+        params = [float(header[9 + 7 * i : 16 + 7 * i]) for i in range(12)]
+        nx = int(header[93:96])
+        ny = int(header[96:99])
+        nz = int(header[99:102])
+        header_length = int(header[104:108])
+
+        # Grids larger than 999 points store the thousands in the grid field
+        # of the label, as characters offset from "@"
+        grid = label["grid"]
+        if ord(grid[0]) >= 64:
+            nx += (ord(grid[0]) - 64) * 1000
+        if ord(grid[1]) >= 64:
+            ny += (ord(grid[1]) - 64) * 1000
+
+        self.grid = ARLGrid(params, nx, ny)
+        self.record_length = LABEL_LENGTH + nx * ny
+
+        levels = record[LABEL_LENGTH + HEADER_LENGTH : LABEL_LENGTH + header_length]
+        if len(levels) < header_length - HEADER_LENGTH:
+            levels = self._read(
+                LABEL_LENGTH + HEADER_LENGTH, header_length - HEADER_LENGTH
+            )
+        levels = bytes(levels).decode("ascii")
+        self.levels = []
+        position = 0
+        for _ in range(nz):
+            height = float(levels[position : position + 6])
+            nvars = int(levels[position + 6 : position + 8])
+            position += 8
+            variables = [
+                levels[position + 8 * i : position + 8 * i + 4].strip()
+                for i in range(nvars)
+            ]
+            position += 8 * nvars
+            self.levels.append((height, variables))
+
+        self.records_per_time = 1 + sum(len(v) for _, v in self.levels)
+        self.period_length = self.records_per_time * self.record_length
+
+    @property
+    def times(self):
+        """Valid times of each time period in the file"""
+        if self._times is None:
+            self._times = []
+            ranges = [
+                (period * self.period_length, LABEL_LENGTH + HEADER_LENGTH)
+                for period in range(self.size // self.period_length)
+            ]
+            for record in self._read_many(ranges):
+                record = bytes(record)
+                minutes = int(record[LABEL_LENGTH + 7 : LABEL_LENGTH + 9])
+                time = _parse_label(record[:LABEL_LENGTH])["time"]
+                self._times.append(time + timedelta(minutes=minutes))
+        return self._times
+
+    def offset(self, variable: str, level: int = 0, time: datetime = None) -> int:
+        """Byte offset of the record for a variable, level and time
+
+        Args:
+            variable (str): four character ARL variable name, e.g. U10M
+            level (int): zero based level index, 0 is the surface
+            time (datetime, optional): valid time in UTC. Timezone aware
+                datetimes are converted to UTC. Defaults to the first time.
+        """
+        period = 0 if time is None else self._period(time)
+        try:
+            index = self.levels[level][1].index(variable)
+        except (IndexError, ValueError):
+            raise KeyError(f"{variable} not found at level {level}")
+        record = 1 + sum(len(v) for _, v in self.levels[:level]) + index
+        return period * self.period_length + record * self.record_length
+
+    def _period(self, time: datetime) -> int:
+        if time.tzinfo is not None:
+            time = time.astimezone(timezone.utc).replace(tzinfo=None)
+        try:
+            return self.times.index(time)
+        except ValueError:
+            raise KeyError(f"{time} not found in ARL file")
+
+    def read(self, variable: str, level: int = 0, time: datetime = None):
+        """Read and unpack a single record
+
+        Args:
+            variable (str): four character ARL variable name, e.g. U10M
+            level (int): zero based level index, 0 is the surface
+            time (datetime, optional): valid time in UTC. Defaults to the first
+                time period in the file.
+
+        Returns:
+            np.ndarray: float32 array of shape (ny, nx), south to north
+        """
+        record = self._read(self.offset(variable, level, time), self.record_length)
+        return self.unpack(record)
+
+    def read_records(self, requests):
+        """Read and unpack several records, fetching only their byte ranges
+
+        Args:
+            requests (list): (variable, level, time) tuples, see read()
+
+        Returns:
+            list of np.ndarray: unpacked float32 arrays in the order requested
+        """
+        ranges = [(self.offset(*request), self.record_length) for request in requests]
+        return [self.unpack(record) for record in self._read_many(ranges)]
+
+    def unpack(self, record: bytes):
+        """Unpack a full record, label included"""
+        label = _parse_label(bytes(record[:LABEL_LENGTH]))
+        return unpack(
+            memoryview(record)[LABEL_LENGTH:],
+            self.grid.nx,
+            self.grid.ny,
+            label["exponent"],
+            label["initial"],
+            label["precision"],
+        )
+
+
+def read_wind(source, time: datetime = None, level: int = 0):
+    """Read the horizontal wind components for a single time and level
+
+    Args:
+        source (str, bytes-like or file-like): path to an ARL file, its
+            contents or a binary file object, see ARLFile
+        time (datetime, optional): valid time in UTC. Defaults to the first
+            time period in the file.
+        level (int): zero based level index. Level 0 reads the 10 m winds.
+
+    Returns:
+        tuple: (u, v, grid) where u and v are float32 arrays of shape (ny, nx)
+            in m/s and grid is the ARLGrid describing their positions. The
+            components are grid-relative, see ARLGrid.convergence.
+    """
+    names = SURFACE_WIND if level == 0 else UPPER_WIND
+    with ARLFile(source) as arl:
+        u, v = arl.read_records([(name, level, time) for name in names])
+        return u, v, arl.grid
+
+
+def read_winds(source, start: datetime = None, end: datetime = None, level: int = 0):
+    """Read the horizontal wind components for every time period of a file
+
+    All of the records are fetched in a single pass, so a forecast cycle only
+    has to be downloaded and indexed once to verify each of its lead times.
+
+    Args:
+        source (str, bytes-like or file-like): path to an ARL file, its
+            contents or a binary file object, see ARLFile
+        start (datetime, optional): earliest valid time to read, in UTC
+        end (datetime, optional): latest valid time to read, in UTC
+        level (int): zero based level index. Level 0 reads the 10 m winds.
+
+    Returns:
+        tuple: (times, u, v, grid) where times are the valid times read, u and
+            v are float32 arrays of shape (len(times), ny, nx) in m/s and grid
+            is the ARLGrid describing their positions. The components are
+            grid-relative, see ARLGrid.convergence.
+    """
+    start, end = [
+        t.astimezone(timezone.utc).replace(tzinfo=None)
+        if t is not None and t.tzinfo is not None
+        else t
+        for t in (start, end)
+    ]
+    names = SURFACE_WIND if level == 0 else UPPER_WIND
+    with ARLFile(source) as arl:
+        times = [
+            time
+            for time in arl.times
+            if (start is None or time >= start) and (end is None or time <= end)
+        ]
+        fields = arl.read_records(
+            [(name, level, time) for time in times for name in names]
+        )
+        shape = (len(times), arl.grid.ny, arl.grid.nx)
+        u = np.array(fields[0::2], dtype=np.float32).reshape(shape)
+        v = np.array(fields[1::2], dtype=np.float32).reshape(shape)
+        return times, u, v, arl.grid
+
+
+def wind_dataset(times, u, v, grid):
+    """xarray Dataset of wind components, e.g. from read_winds
+
+    The decoded arrays are wrapped rather than copied, so the dataset stays
+    entirely in memory without going through an intermediate NetCDF file.
+
+    Args:
+        times (list of datetime): valid times, in UTC
+        u (np.ndarray): (time, ny, nx) grid-relative u wind component in m/s
+        v (np.ndarray): (time, ny, nx) grid-relative v wind component in m/s
+        grid (ARLGrid): grid of u and v, see ARLGrid.convergence
+
+    Returns:
+        xr.Dataset: u and v variables on (time, y, x), with 2 dimensional lat
+            and lon coordinates
+    """
+    import xarray as xr
+
+    lat, lon = grid.latlon()
+    return xr.Dataset(
+        {"u": (("time", "y", "x"), u), "v": (("time", "y", "x"), v)},
+        coords={
+            "time": np.array(times, dtype="datetime64[ns]"),
+            "lat": (("y", "x"), lat),
+            "lon": (("y", "x"), lon),
+        },
+    )
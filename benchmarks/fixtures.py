@@ -0,0 +1,488 @@
+"""Synthetic inputs for the benchmarks, generated without credentials or network
+
+write_arl writes ARL files of any grid size and number of hours, packing
+known fields (see field) so decoded values can be checked, nearesttime and
+timeseries build MesoWest API responses for any number of stations, and
+LocalBucket and LocalMesoWest stand in for the GCS bucket and MesoWest API so
+the real download and parsing code runs against them.
+"""
+import base64
+import hashlib
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from arl import ARLGrid
+from GoogleCloudStorage import GoogleCloudStorageBucket
+
+# Lambert conformal grid of the HRRR files: 3 km cells, true at 38.5N, 97.5W,
+# with the first cell at 21.14N, 122.72W
+HRRR_PARAMS = [90.0, 0.0, 38.5, -97.5, 3.0, 0.0, 38.5, 1.0, 1.0, 21.14, -122.72, 0.0]
+
+# Shape (nx, ny) of the CONUS HRRR grid
+HRRR_SHAPE = (1799, 1059)
+
+# Variables of the surface level and of each level above it
+SURFACE_VARIABLES = ("PRSS", "T02M", "U10M", "V10M")
+UPPER_VARIABLES = ("UWND", "VWND", "WWND", "TEMP", "SPHU")
+
+MESOWEST_VARIABLES = ("wind_speed", "wind_direction", "air_temp")
+
+
+def _label(time, level, grid, variable, exponent=0, precision=0.0, initial=0.0):
+    return (
+        "%02d%02d%02d%02d%02d%02d%2s%4s%4d%14.7E%14.7E"
+        % (
+            time.year % 100,
+            time.month,
+            time.day,
+            time.hour,
+            0,
+            level,
+            grid,
+            variable,
+            exponent,
+            precision,
+            initial,
+        )
+    ).encode()
+
+
+def _index(nx, ny, levels):
+    # Parameters wider than 7 characters lose a decimal, as HYSPLIT writes them
+    params = "".join(f"{p:7.2f}" if abs(p) < 1000 else f"{p:7.1f}" for p in HRRR_PARAMS)
+    heights = "".join(
+        f"{height:6.2f}{len(variables):2d}"
+        + "".join(f"{variable:4s}{0:3d} " for variable in variables)
+        for height, variables in levels
+    )
+    header = (
+        f"{'HRRR':4s}{0:3d}{0:2d}"
+        + params
+        + f"{nx % 1000:3d}{ny % 1000:3d}{len(levels):3d}{2:2d}"
+        + f"{108 + len(heights):4d}"
+    )
+    return (header + heights).encode()
+
+
+def field(nx, ny, hour=0, level=0, variable="U10M", seed=0):
+    """Known values of a variable in a file written by write_arl
+
+    Each variable, level and hour is a different smooth field, so a decoder
+    that reads the wrong record or unpacks it wrongly doesn't match.
+
+    Returns:
+        np.ndarray: float64 array of shape (ny, nx), south to north
+    """
+    rng = np.random.default_rng([seed, hour, level, *variable.encode()])
+    offset, a, b = rng.uniform(-5, 5, 3)
+    px, py = rng.uniform(0, 1, 2)
+    x = np.sin(2 * np.pi * (2 * np.arange(nx) / nx + px))
+    y = np.cos(2 * np.pi * (3 * np.arange(ny) / ny + py))
+    return offset + a * x[None, :] + b * y[:, None]
+
+
+def _exponent(values):
+    # Packing exponent of HYSPLIT's PAKREC, from the largest difference between
+    # neighbors along the rows and down the first column
+    rmax = max(
+        np.abs(np.diff(values, axis=1)).max(initial=0),
+        np.abs(np.diff(values[:, 0])).max(initial=0),
+    )
+    sexp = np.log2(rmax) if rmax else 0.0
+    nexp = int(sexp)
+    if sexp >= 0 or sexp % 1 == 0:
+        nexp += 1
+    return nexp
+
+
+def precision(values):
+    """Largest error of values after packing, one step of the packed bytes"""
+    return 2.0 ** (_exponent(np.asarray(values, dtype=float)) - 7)
+
+
+def pack(values):
+    """Differentially pack a field as HYSPLIT's PAKREC does
+
+    The inverse of arl.unpack. Each byte is rounded from the difference to the
+    previous unpacked value, so rounding errors don't accumulate along a row.
+
+    Args:
+        values (array-like): (ny, nx) field, south to north
+
+    Returns:
+        tuple: (packed, exponent, initial) where packed is the nx * ny bytes
+            of the record, and exponent and initial go in its label
+    """
+    values = np.asarray(values, dtype=float)
+    ny, nx = values.shape
+    nexp = _exponent(values)
+    scale = 2.0 ** (7 - nexp)
+    packed = np.empty((ny, nx), dtype=np.uint8)
+
+    # The first value of each row is packed against the first of the previous
+    # row, then each column against the previous one, all rows at once
+    old = np.empty(ny)
+    previous = values[0, 0]
+    for j in range(ny):
+        code = int((values[j, 0] - previous) * scale + 127.5)
+        packed[j, 0] = code
+        previous = old[j] = (code - 127) / scale + previous
+    for i in range(1, nx):
+        code = np.floor((values[:, i] - old) * scale + 127.5)
+        packed[:, i] = code
+        old = (code - 127) / scale + old
+    return packed.tobytes(), nexp, float(values[0, 0])
+
+
+def write_arl(path, nx=200, ny=150, hours=6, levels=1, start=None, seed=0):
+    """Write an ARL file of known, smoothly varying fields on the HRRR grid
+
+    Every record is packed from field(nx, ny, hour, level, variable, seed),
+    where hour counts from the first time period.
+
+    Args:
+        path (str): output file
+        nx (int): number of grid points in the x direction
+        ny (int): number of grid points in the y direction
+        hours (int): number of hourly time periods
+        levels (int): number of levels, including the surface
+        start (datetime, optional): first time period. Defaults to
+            2021-01-20 06:00.
+        seed (int): random seed
+
+    Returns:
+        ARLGrid: grid of the file
+    """
+    start = start or datetime(2021, 1, 20, 6)
+    if nx > 999 or ny > 999:
+        grid = chr(64 + nx // 1000) + chr(64 + ny // 1000)
+    else:
+        grid = "99"
+    layout = [(0.0, SURFACE_VARIABLES)] + [
+        (float(level), UPPER_VARIABLES) for level in range(1, levels)
+    ]
+    index = _index(nx, ny, layout)
+    if len(index) > nx * ny:
+        raise ValueError(f"{nx}x{ny} grid is too small for {levels} levels")
+
+    with open(path, "wb") as f:
+        for hour in range(hours):
+            time = start + timedelta(hours=hour)
+            f.write(_label(time, 0, grid, "INDX") + index.ljust(nx * ny, b" "))
+            for level, (_, variables) in enumerate(layout):
+                for variable in variables:
+                    values = field(nx, ny, hour, level, variable, seed)
+                    packed, exponent, initial = pack(values)
+                    f.write(_label(time, level, grid, variable, exponent, 0.0, initial))
+                    f.write(packed)
+    return ARLGrid(HRRR_PARAMS, nx, ny)
+
+
+def grid_wind(grid, u, v):
+    """Grid-relative components of the same wind at every cell of a grid
+
+    The direction of true north at each cell is found by differencing the
+    projection a hundredth of a degree northwards, independently of
+    ARLGrid.convergence.
+
+    Args:
+        grid (ARLGrid): grid definition
+        u (float): eastward wind component
+        v (float): northward wind component
+
+    Returns:
+        tuple of np.ndarray: float32 (ny, nx) components along the grid's x
+            and y axes
+    """
+    lat, lon = grid.latlon()
+    x0, y0 = grid.xy(lat, lon)
+    x1, y1 = grid.xy(lat + 0.01, lon)
+    length = np.hypot(x1 - x0, y1 - y0)
+    north_x, north_y = (x1 - x0) / length, (y1 - y0) / length
+    # East is north turned 90 degrees clockwise
+    return (
+        (u * north_y + v * north_x).astype(np.float32),
+        (v * north_y - u * north_x).astype(np.float32),
+    )
+
+
+def stations(grid, n, seed=0):
+    """Random station coordinates inside a grid
+
+    Returns:
+        tuple of np.ndarray: (lat, lon) in degrees
+    """
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(0, grid.nx - 1, n)
+    y = rng.uniform(0, grid.ny - 1, n)
+    return grid.latlon(x, y)
+
+
+def nearesttime(lat, lon, time=None, variables=MESOWEST_VARIABLES, seed=0):
+    """MesoWest nearesttime API response with a station at each coordinate
+
+    About one in ten station variables is missing, and one in twenty has a
+    second sensor set.
+
+    Args:
+        lat (array-like): station latitudes in degrees
+        lon (array-like): station longitudes in degrees
+        time (datetime, optional): time of the observations
+        variables (tuple of str): observed variables
+        seed (int): random seed
+
+    Returns:
+        dict: decoded JSON response
+    """
+    rng = np.random.default_rng(seed)
+    time = time or datetime(2021, 1, 20, 6)
+    response = []
+    for i, (la, lo) in enumerate(zip(lat, lon)):
+        sensors = {}
+        observations = {}
+        for variable in variables:
+            if rng.random() < 0.1:
+                continue
+            sets = 2 if rng.random() < 0.05 else 1
+            sensors[variable] = {}
+            for s in range(1, sets + 1):
+                name = f"{variable}_value_{s}"
+                sensors[variable][name] = {"position": ""}
+                observations[name] = {
+                    "value": round(float(rng.uniform(0, 20)), 2),
+                    "date_time": f"{time:%Y-%m-%dT%H}:{rng.integers(0, 60):02d}:00Z",
+                }
+        response.append(
+            {
+                "NAME": f"Station {i}",
+                "STID": f"S{i:05d}",
+                "LATITUDE": f"{la:.5f}",
+                "LONGITUDE": f"{lo:.5f}",
+                "ELEVATION": str(int(rng.integers(0, 9000))),
+                "SENSOR_VARIABLES": sensors,
+                "OBSERVATIONS": observations,
+            }
+        )
+    return {
+        "SUMMARY": {"RESPONSE_CODE": 1, "RESPONSE_MESSAGE": "OK"},
+        "UNITS": {variable: "" for variable in variables},
+        "STATION": response,
+    }
+
+
+def timeseries(hours, start=None, variables=MESOWEST_VARIABLES, seed=0):
+    """MesoWest timeseries API response of a single station
+
+    Args:
+        hours (int): number of hourly observations
+        start (datetime, optional): time of the first observation
+        variables (tuple of str): observed variables
+        seed (int): random seed
+
+    Returns:
+        dict: decoded JSON response
+    """
+    rng = np.random.default_rng(seed)
+    start = start or datetime(2021, 1, 1)
+    dates = [f"{start + timedelta(hours=h):%Y-%m-%dT%H:%M:%SZ}" for h in range(hours)]
+    sensors = {"date_time": {}}
+    observations = {"date_time": dates}
+    for variable in variables:
+        sensors[variable] = {f"{variable}_set_1": {"position": ""}}
+        observations[f"{variable}_set_1"] = np.round(
+            rng.uniform(0, 20, hours), 2
+        ).tolist()
+    return {
+        "SUMMARY": {"RESPONSE_CODE": 1, "RESPONSE_MESSAGE": "OK"},
+        "UNITS": {variable: "" for variable in variables},
+        "STATION": [
+            {
+                "NAME": "Station 0",
+                "STID": "S00000",
+                "LATITUDE": "40.65",
+                "LONGITUDE": "-112.0",
+                "ELEVATION": "4226",
+                "SENSOR_VARIABLES": sensors,
+                "OBSERVATIONS": observations,
+            }
+        ],
+    }
+
+
+class LocalMesoWest:
+    def __init__(self, response):
+        """Stand-in for MesoWest_BB.MesoWestClient that answers every request
+        with the same response
+
+        The response is kept as JSON text and decoded on each request, as the
+        real client does.
+
+        Args:
+            response (dict): decoded JSON response, e.g. from nearesttime
+        """
+        self.text = json.dumps(response)
+
+    def get(self, URL, verbose=True):
+        return json.loads(self.text)
+
+    def get_many(self, URLs, verbose=True):
+        return [self.get(URL, verbose) for URL in URLs]
+
+
+@contextmanager
+def mesowest(response):
+    """Answer the MesoWest_BB functions with response, bypassing their cache"""
+    import MesoWest_BB
+
+    client, token = MesoWest_BB._client, None
+    cache = MesoWest_BB._cache, MesoWest_BB.MESOWEST_CACHE_DIR
+    MesoWest_BB._client = LocalMesoWest(response)
+    MesoWest_BB._cache = MesoWest_BB.MESOWEST_CACHE_DIR = None
+    if not MesoWest_BB.MESOWEST_TOKEN and not os.getenv("MESOWEST_TOKEN"):
+        token = MesoWest_BB.MESOWEST_TOKEN = "benchmark"
+    try:
+        yield MesoWest_BB._client
+    finally:
+        MesoWest_BB._client = client
+        MesoWest_BB._cache, MesoWest_BB.MESOWEST_CACHE_DIR = cache
+        if token:
+            MesoWest_BB.MESOWEST_TOKEN = None
+
+
+class LocalBlob:
+    def __init__(self, root, name, latency=0.0):
+        """File with the subset of the google.cloud.storage.Blob interface
+        used by GoogleCloudStorage.py
+
+        Args:
+            root (str): directory standing in for the bucket
+            name (str): path of the file relative to root
+            latency (float): seconds each request waits, to model the round
+                trip to GCS
+        """
+        self.name = name
+        self.path = os.path.join(root, name)
+        self.latency = latency
+        self._crc32c = None
+        self._md5_hash = None
+
+    @property
+    def size(self):
+        return os.path.getsize(self.path)
+
+    @property
+    def generation(self):
+        return os.stat(self.path).st_mtime_ns
+
+    @property
+    def crc32c(self):
+        if self._crc32c is None:
+            from GoogleCloudStorage import google_crc32c
+
+            if google_crc32c is not None:
+                self._crc32c = self._checksum(google_crc32c.Checksum())
+        return self._crc32c
+
+    @property
+    def md5_hash(self):
+        if self._md5_hash is None:
+            self._md5_hash = self._checksum(hashlib.md5())
+        return self._md5_hash
+
+    def _checksum(self, checksum):
+        with open(self.path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                checksum.update(chunk)
+        return base64.b64encode(checksum.digest()).decode()
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def download_as_bytes(self, start=None, end=None, if_generation_match=None):
+        time.sleep(self.latency)
+        if if_generation_match is not None and if_generation_match != self.generation:
+            raise IOError(f"{self.name} has changed")
+        with open(self.path, "rb") as f:
+            f.seek(start or 0)
+            return f.read(-1 if end is None else end - (start or 0) + 1)
+
+    def download_to_filename(self, filename):
+        time.sleep(self.latency)
+        shutil.copyfile(self.path, filename)
+
+    def upload_from_filename(self, filename):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        shutil.copyfile(filename, self.path)
+
+
+class _LocalDirectory:
+    def __init__(self, root, latency=0.0):
+        self.root = root
+        self.latency = latency
+
+    def blob(self, name):
+        return LocalBlob(self.root, name, self.latency)
+
+    def get_blob(self, name):
+        blob = self.blob(name)
+        return blob if blob.exists() else None
+
+
+class LocalBucket(GoogleCloudStorageBucket):
+    def __init__(self, root, cache=None, latency=0.0):
+        """GoogleCloudStorageBucket backed by a local directory
+
+        Only the storage client is replaced, so downloads, caching, range
+        reads and checksums run through the same code as with GCS.
+
+        Args:
+            root (str): directory standing in for the bucket
+            cache (BlobCache, optional): local cache used by fetch()
+            latency (float): seconds each request waits, to model the round
+                trip to GCS
+        """
+        self.client = None
+        self.bucket = _LocalDirectory(root, latency)
+        self.bucket_name = os.path.basename(os.path.normpath(root))
+        self.cache = cache
+
+    def ls(self, prefix=None, fields=None):
+        blobs = []
+        for directory, _, files in os.walk(self.bucket.root):
+            for file in files:
+                name = os.path.relpath(os.path.join(directory, file), self.bucket.root)
+                name = name.replace(os.sep, "/")
+                if name.startswith(prefix or ""):
+                    blobs.append(self.bucket.blob(name))
+        return sorted(blobs, key=lambda blob: blob.name)
+
+
+def netcdf_values(nx=600, ny=400, layers=5, seed=0):
+    """Values written by write_netcdf, with latitude increasing along axis 1"""
+    return np.random.default_rng(seed).random((layers, ny, nx), dtype=np.float32)
+
+
+def write_netcdf(path, nx=600, ny=400, layers=5, seed=0):
+    """Write a (layers, lat, lon) float32 netCDF file readable by raster.Raster
+
+    The grid spans 125W to 95W and 30N to 50N, see netcdf_values.
+    """
+    from netCDF4 import Dataset
+
+    with Dataset(path, "w") as nc:
+        nc.crs = "+proj=longlat +datum=WGS84"
+        nc.createDimension("time", layers)
+        nc.createDimension("lat", ny)
+        nc.createDimension("lon", nx)
+        nc.createVariable("time", "f8", ("time",))[:] = 1.6e9 + 3600 * np.arange(layers)
+        nc.createVariable("lat", "f8", ("lat",))[:] = np.linspace(30, 50, ny)
+        nc.createVariable("lon", "f8", ("lon",))[:] = np.linspace(-125, -95, nx)
+        foot = nc.createVariable("foot", "f4", ("time", "lat", "lon"))
+        foot[:] = netcdf_values(nx, ny, layers, seed)
+    return path
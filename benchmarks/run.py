@@ -0,0 +1,638 @@
+"""
+Offline benchmarks of the evaluation pipeline.
+
+Every benchmark runs against synthetic inputs (see benchmarks/fixtures.py), so no
+credentials or network are needed. Each one is run over a range of station counts,
+grid sizes or hours, and the time per call is reported along with how it scales: the
+slope of log(time) against log(size), i.e. 1 for linear scaling.
+
+    python -m benchmarks.run --quick
+    python -m benchmarks.run --output bench.json
+    python -m benchmarks.run --baseline bench.json --tolerance 0.25
+
+With --baseline, the exit status is non-zero if any benchmark got slower than the
+baseline by more than the tolerance.
+"""
+import argparse
+import filecmp
+import fnmatch
+import functools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import timeit
+from datetime import datetime
+
+import numpy as np
+
+from arl import ARLGrid
+from benchmarks import fixtures
+
+# Sizes of the HRRR grids: the SLC subset, a regional grid and CONUS
+GRIDS = [(40, 48), (600, 400), fixtures.HRRR_SHAPE]
+STATIONS = [10, 100, 1000, 10000]
+
+CONUS = ARLGrid(fixtures.HRRR_PARAMS, *fixtures.HRRR_SHAPE)
+
+# Time of the synthetic observations, and of the first hour of the ARL files
+DATE = datetime(2021, 1, 20, 6)
+
+# East and north components of the wind used to check the rotation of
+# grid-relative winds
+EARTH_WIND = (3.0, -8.0)
+
+BENCHMARKS = []
+
+# Seconds each GCS request of a LocalBucket waits, set by --latency
+latency = 0.0
+
+
+def benchmark(name, param, values, quick=None, size=None):
+    """Register a benchmark
+
+    The decorated function is a generator that takes a scratch directory and
+    a parameter value, sets up its inputs and yields the function to time.
+    Code after the yield runs once timing is done.
+
+    Args:
+        name (str): name of the benchmark
+        param (str): name of the parameter, e.g. "stations"
+        values (list): parameter values to run
+        quick (list, optional): values to run with --quick. Defaults to all.
+        size (callable, optional): size of a parameter value, used for the
+            scaling exponent. Defaults to the value itself.
+    """
+
+    def register(func):
+        BENCHMARKS.append(
+            {
+                "name": name,
+                "param": param,
+                "values": values,
+                "quick": quick or values,
+                "size": size or (lambda value: value),
+                "func": func,
+            }
+        )
+        return func
+
+    return register
+
+
+def _cells(grid):
+    return grid[0] * grid[1]
+
+
+def _label(value):
+    return "x".join(map(str, value)) if isinstance(value, tuple) else str(value)
+
+
+def _arl(tmp, grid, hours=6):
+    """Path of a synthetic ARL file in a bucket directory, written once"""
+    name = f"hrrr/{_label(grid)}_{hours}h.arl"
+    path = os.path.join(tmp, "bucket", name)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fixtures.write_arl(path, *grid, hours=hours)
+    return name, path
+
+
+def _check_wind(u, v, grid, hour=0):
+    """Assert that decoded winds match the fields packed by write_arl"""
+    for values, variable in ((u, "U10M"), (v, "V10M")):
+        expected = fixtures.field(*grid, hour, 0, variable)
+        np.testing.assert_allclose(
+            values, expected, rtol=0, atol=fixtures.precision(expected)
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def _grid_wind():
+    return fixtures.grid_wind(CONUS, *EARTH_WIND)
+
+
+def _check_rotation(index):
+    """Assert that extract_wind turns grid-relative winds to true north"""
+    from extract import extract_wind, wind_speed_direction
+
+    ws, wd = extract_wind(*_grid_wind(), index)
+    expected_ws, expected_wd = wind_speed_direction(*EARTH_WIND)
+    np.testing.assert_allclose(ws, expected_ws, rtol=1e-3)
+    np.testing.assert_allclose((wd - expected_wd + 180) % 360 - 180, 0, atol=0.05)
+
+
+@functools.lru_cache(maxsize=None)
+def _cell_tree():
+    from scipy.spatial import cKDTree
+
+    x, y = np.meshgrid(np.arange(CONUS.nx), np.arange(CONUS.ny))
+    return cKDTree(np.column_stack([x.ravel(), y.ravel()]))
+
+
+def _check_extract(ws, wd, method, u, v, lat, lon):
+    """Assert that extract_wind matches a direct interpolation of u and v"""
+    from scipy import ndimage
+
+    from extract import wind_speed_direction
+
+    x, y = CONUS.xy(lat, lon)
+    x = np.clip(x, 0, CONUS.nx - 1)
+    y = np.clip(y, 0, CONUS.ny - 1)
+    if method == "nearest":
+        row, col = np.rint(y).astype(np.intp), np.rint(x).astype(np.intp)
+        u, v = u[row, col], v[row, col]
+    elif method == "bilinear":
+        u, v = [
+            ndimage.map_coordinates(f.astype(float), [y, x], order=1) for f in (u, v)
+        ]
+    else:
+        distance, cells = _cell_tree().query(np.column_stack([x, y]), k=4)
+        weights = 1 / np.maximum(distance, 1e-9) ** 2
+        weights /= weights.sum(axis=1, keepdims=True)
+        u, v = [(f.ravel()[cells] * weights).sum(axis=1) for f in (u, v)]
+
+    angle = np.deg2rad(CONUS.convergence(lon))
+    expected_ws, expected_wd = wind_speed_direction(
+        np.cos(angle) * u + np.sin(angle) * v, np.cos(angle) * v - np.sin(angle) * u
+    )
+    # Compare the wind vectors, as the direction of a calm wind is meaningless
+    np.testing.assert_allclose(
+        ws * np.exp(1j * np.deg2rad(wd)),
+        expected_ws * np.exp(1j * np.deg2rad(expected_wd)),
+        rtol=0,
+        atol=1e-4,
+    )
+
+
+def _mercator_reference(data, lat_bounds):
+    """mercator_transform of an upper origin image, as the loop over columns
+    of the Folium original"""
+
+    def mercator(x):
+        return np.arcsinh(np.tan(x * np.pi / 180.0)) * 180.0 / np.pi
+
+    array = np.atleast_3d(data)[::-1]
+    height, width, nblayers = array.shape
+    lat_min = max(lat_bounds[0], -85.051128779806589)
+    lat_max = min(lat_bounds[1], 85.051128779806589)
+    lats = lat_min + np.linspace(0.5 / height, 1.0 - 0.5 / height, height) * (
+        lat_max - lat_min
+    )
+    latslats = mercator(lat_min) + np.linspace(
+        0.5 / height, 1.0 - 0.5 / height, height
+    ) * (mercator(lat_max) - mercator(lat_min))
+
+    out = np.zeros((height, width, nblayers))
+    for i in range(width):
+        for j in range(nblayers):
+            out[:, i, j] = np.interp(latslats, mercator(lats), array[:, i, j])
+    return out[::-1]
+
+
+def _check_raster(raster, expected):
+    """Assert that a raster holds expected, a (..., lat, lon) array with
+    latitude increasing as in fixtures.netcdf_values"""
+    # Raster stores rows from north to south
+    np.testing.assert_allclose(raster.values, expected[..., ::-1, :], rtol=1e-6)
+
+
+def _check_nearesttime(result, response):
+    """Assert that parsed columns match the stations of a nearesttime response"""
+    stations = response["STATION"]
+    assert list(result["STID"]) == [s["STID"] for s in stations]
+    np.testing.assert_array_equal(
+        result["LAT"], [float(s["LATITUDE"]) for s in stations]
+    )
+    np.testing.assert_array_equal(
+        result["LON"], [float(s["LONGITUDE"]) for s in stations]
+    )
+    for variable in response["UNITS"]:
+        # The first sensor set is used by default
+        observed = [s["OBSERVATIONS"].get(f"{variable}_value_1") for s in stations]
+        np.testing.assert_array_equal(
+            result[variable], [o["value"] if o else np.nan for o in observed]
+        )
+        np.testing.assert_array_equal(
+            result[variable + "_DATETIME"],
+            np.array([o["date_time"][:-1] if o else "NaT" for o in observed], "M8[s]"),
+        )
+
+
+def _check_timeseries(result, response):
+    """Assert that a parsed time series matches a timeseries response"""
+    observations = response["STATION"][0]["OBSERVATIONS"]
+    assert result["STID"] == response["STATION"][0]["STID"]
+    assert result["DATETIME"] == [
+        datetime.strptime(date, "%Y-%m-%dT%H:%M:%SZ")
+        for date in observations["date_time"]
+    ]
+    for variable in response["UNITS"]:
+        np.testing.assert_array_equal(
+            result[variable], observations[f"{variable}_set_1"]
+        )
+
+
+def _bucket(tmp, cache=None):
+    return fixtures.LocalBucket(os.path.join(tmp, "bucket"), cache, latency)
+
+
+@benchmark("mesowest.radius", "stations", STATIONS, quick=[10, 1000])
+def mesowest_radius(tmp, n):
+    """Query, decode and parse of a nearesttime response"""
+    from MesoWest_BB import get_mesowest_radius
+
+    lat, lon = fixtures.stations(CONUS, n)
+    response = fixtures.nearesttime(lat, lon, DATE)
+
+    def query():
+        return get_mesowest_radius(DATE, "40.65,-112.0", verbose=False)
+
+    with fixtures.mesowest(response):
+        _check_nearesttime(query(), response)
+        yield query
+
+
+@benchmark("mesowest.timeseries", "hours", [24, 720, 8760], quick=[24, 720])
+def mesowest_timeseries(tmp, hours):
+    """Query, decode and parse of a timeseries response"""
+    from MesoWest_BB import get_mesowest_ts
+
+    response = fixtures.timeseries(hours, DATE)
+
+    def query():
+        return get_mesowest_ts("S00000", DATE, DATE, verbose=False)
+
+    with fixtures.mesowest(response):
+        _check_timeseries(query(), response)
+        yield query
+
+
+@benchmark("gcs.download", "grid", GRIDS, quick=GRIDS[:2], size=_cells)
+def gcs_download(tmp, grid):
+    """Chunked, checksummed download of an ARL file to disk"""
+    name, path = _arl(tmp, grid)
+    bucket = _bucket(tmp)
+    local = os.path.join(tmp, "download", os.path.basename(name))
+
+    def download():
+        bucket.download(
+            name, local, overwrite=True, workers=4, chunk_size=4 * 1024 * 1024
+        )
+
+    download()
+    assert filecmp.cmp(local, path, shallow=False)
+    yield download
+
+
+@benchmark("gcs.read", "grid", GRIDS, quick=GRIDS[:2], size=_cells)
+def gcs_read(tmp, grid):
+    """Download of an ARL file into memory"""
+    name, path = _arl(tmp, grid)
+    bucket = _bucket(tmp)
+    with open(path, "rb") as f:
+        assert bucket.read(name) == f.read()
+    yield lambda: bucket.read(name)
+
+
+@benchmark("gcs.fetch_cached", "grid", GRIDS, quick=GRIDS[:2], size=_cells)
+def gcs_fetch_cached(tmp, grid):
+    """Revalidated lookup of an ARL file already in the BlobCache"""
+    from GoogleCloudStorage import BlobCache
+
+    name, path = _arl(tmp, grid)
+    bucket = _bucket(tmp, BlobCache(os.path.join(tmp, "cache")))
+    bucket.fetch(name)
+    assert filecmp.cmp(bucket.fetch(name), path, shallow=False)
+    yield lambda: bucket.fetch(name)
+
+
+@benchmark("arl.read_wind", "grid", GRIDS, quick=GRIDS[:2], size=_cells)
+def arl_read_wind(tmp, grid):
+    """Decode of the surface winds of one hour from a local file"""
+    from arl import read_wind
+
+    _, path = _arl(tmp, grid)
+    _check_wind(*read_wind(path, DATE)[:2], grid)
+    yield lambda: read_wind(path, DATE)
+
+
+@benchmark("arl.read_wind_memory", "grid", GRIDS, quick=GRIDS[:2], size=_cells)
+def arl_read_wind_memory(tmp, grid):
+    """Decode of the surface winds of one hour from bytes in memory"""
+    from arl import read_wind
+
+    _, path = _arl(tmp, grid)
+    with open(path, "rb") as f:
+        data = f.read()
+    _check_wind(*read_wind(data, DATE)[:2], grid)
+    yield lambda: read_wind(data, DATE)
+
+
+@benchmark("arl.read_wind_range", "grid", GRIDS, quick=GRIDS[:2], size=_cells)
+def arl_read_wind_range(tmp, grid):
+    """Decode of the surface winds of one hour using range reads of a blob"""
+    from arl import read_wind
+
+    name, _ = _arl(tmp, grid)
+    bucket = _bucket(tmp)
+
+    def read():
+        with bucket.open(name) as f:
+            return read_wind(f, DATE)
+
+    _check_wind(*read()[:2], grid)
+    yield read
+
+
+@benchmark("arl.read_winds", "grid", GRIDS, quick=GRIDS[:2], size=_cells)
+def arl_read_winds(tmp, grid):
+    """Decode of the surface winds of every hour (6) of a cycle"""
+    from arl import read_winds
+
+    _, path = _arl(tmp, grid)
+    times, u, v, _ = read_winds(path)
+    assert len(times) == 6 and times[0] == DATE
+    for hour in range(len(times)):
+        _check_wind(u[hour], v[hour], grid, hour)
+    yield lambda: read_winds(path)
+
+
+def _extract(method, cached, dtype=np.float32):
+    def run(tmp, n):
+        import extract
+
+        rng = np.random.default_rng(0)
+        u, v = rng.normal(0, 5, (2, CONUS.ny, CONUS.nx)).astype(dtype)
+        lat, lon = fixtures.stations(CONUS, n)
+        _check_rotation(extract.interpolator(CONUS, lat, lon, method=method))
+
+        def sample():
+            if not cached:
+                extract._cache.clear()
+            index = extract.interpolator(CONUS, lat, lon, method=method)
+            return extract.extract_wind(u, v, index)
+
+        _check_extract(*sample(), method, u, v, lat, lon)
+        yield sample
+
+    run.__doc__ = (
+        f"{method} winds at stations of the CONUS {np.dtype(dtype)} grid, "
+        + ("with the station to grid mapping cached" if cached else "from scratch")
+    )
+    return run
+
+
+# read_wind returns float32 fields, the float64 case shows whether sampling
+# depends on the dtype of the fields
+for _method in ("nearest", "bilinear", "idw"):
+    benchmark(f"extract.{_method}", "stations", STATIONS, quick=[10, 1000])(
+        _extract(_method, cached=False)
+    )
+    benchmark(f"extract.{_method}_cached", "stations", STATIONS, quick=[10, 1000])(
+        _extract(_method, cached=True)
+    )
+    benchmark(
+        f"extract.{_method}_cached_float64", "stations", STATIONS, quick=[10, 1000]
+    )(_extract(_method, cached=True, dtype=np.float64))
+
+
+@benchmark("raster.mercator_transform", "grid", GRIDS, quick=GRIDS[:2], size=_cells)
+def raster_mercator_transform(tmp, grid):
+    """Reprojection of a 2D grid to web mercator, with new row weights"""
+    from raster import _mercator_weights, mercator_transform
+
+    image = np.random.default_rng(0).random((grid[1], grid[0]))
+
+    def transform():
+        _mercator_weights.cache_clear()
+        return mercator_transform(image, [30, 50])
+
+    np.testing.assert_allclose(transform(), _mercator_reference(image, [30, 50]))
+    yield transform
+
+
+@benchmark(
+    "raster.mercator_transform_cached", "grid", GRIDS, quick=GRIDS[:2], size=_cells
+)
+def raster_mercator_transform_cached(tmp, grid):
+    """Reprojection of a 2D grid to web mercator, with cached row weights"""
+    from raster import mercator_transform
+
+    image = np.random.default_rng(0).random((grid[1], grid[0]))
+    np.testing.assert_allclose(
+        mercator_transform(image, [30, 50]), _mercator_reference(image, [30, 50])
+    )
+    yield lambda: mercator_transform(image, [30, 50])
+
+
+def _raster(tmp, grid):
+    from raster import Raster
+
+    path = os.path.join(tmp, f"raster_{_label(grid)}.nc")
+    if not os.path.exists(path):
+        fixtures.write_netcdf(path, *grid, layers=5)
+    return Raster(path)
+
+
+@benchmark("raster.add", "grid", GRIDS, quick=GRIDS[:2], size=_cells)
+def raster_add(tmp, grid):
+    """Sum of two 5 layer rasters into a new raster"""
+    a = _raster(tmp, grid)
+    b = a.copy()
+    _check_raster(a + b, 2 * fixtures.netcdf_values(*grid))
+    yield lambda: a + b
+
+
+@benchmark("raster.iadd", "grid", GRIDS, quick=GRIDS[:2], size=_cells)
+def raster_iadd(tmp, grid):
+    """In-place sum of two 5 layer rasters"""
+    a = _raster(tmp, grid)
+    b = a.copy()
+    c = a.copy()
+    c += b
+    _check_raster(c, 2 * fixtures.netcdf_values(*grid))
+
+    def iadd():
+        nonlocal a
+        a += b
+
+    yield iadd
+
+
+@benchmark("raster.ufunc", "grid", GRIDS, quick=GRIDS[:2], size=_cells)
+def raster_ufunc(tmp, grid):
+    """numpy ufunc (log1p) of a 5 layer raster"""
+    a = _raster(tmp, grid)
+    _check_raster(np.log1p(a), np.log1p(fixtures.netcdf_values(*grid)))
+    yield lambda: np.log1p(a)
+
+
+@benchmark("raster.sum", "grid", GRIDS, quick=GRIDS[:2], size=_cells)
+def raster_sum(tmp, grid):
+    """Sum over the layers of a 5 layer raster"""
+    a = _raster(tmp, grid)
+    _check_raster(a.sum(), fixtures.netcdf_values(*grid).sum(axis=0))
+    yield lambda: a.sum()
+
+
+def startup(tmp, module):
+    """Cold start: import of the module in a new interpreter"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    command = [sys.executable, "-c", f"import {module}"]
+    yield lambda: subprocess.run(command, cwd=root, check=True)
+
+
+# Importing the package is what every CLI call pays before doing any work,
+# importing the pipeline is the cost of the first evaluation
+benchmark("startup.model_eval", "module", ["model_eval"])(startup)
+benchmark("startup.pipeline", "module", ["model_eval.pipeline"])(startup)
+
+
+def measure(func, repeat=5):
+    """Best time of a function in seconds per call
+
+    The number of calls per repeat is chosen so that each repeat takes at
+    least 0.2 seconds.
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+
+def scaling(points):
+    """Slope of log(seconds) against log(size), or None with a single point"""
+    if len(points) < 2:
+        return None
+    size, seconds = np.log(np.array(points, dtype=float)).T
+    return float(np.polyfit(size, seconds, 1)[0])
+
+
+def run(names=None, quick=False, repeat=5, tmp=None):
+    """Run the benchmarks
+
+    Args:
+        names (list of str, optional): only run benchmarks matching these
+            glob patterns, e.g. "arl.*"
+        quick (bool): run a shorter range of sizes
+        repeat (int): number of timing repeats, the best is reported
+        tmp (str, optional): directory the synthetic inputs are written to.
+            Defaults to a temporary directory.
+
+    Returns:
+        list of dict: name, param, value, seconds and scaling of each run
+    """
+    if tmp is None:
+        with tempfile.TemporaryDirectory(prefix="benchmarks-") as tmp:
+            return run(names, quick, repeat, tmp)
+
+    results = []
+    for bench in BENCHMARKS:
+        if names and not any(fnmatch.fnmatch(bench["name"], n) for n in names):
+            continue
+        points = []
+        for value in bench["quick"] if quick else bench["values"]:
+            runner = bench["func"](tmp, value)
+            try:
+                seconds = measure(next(runner), repeat)
+            finally:
+                runner.close()
+            points.append((bench["size"](value), seconds))
+            results.append(
+                {
+                    "name": bench["name"],
+                    "param": bench["param"],
+                    "value": _label(value),
+                    "seconds": seconds,
+                }
+            )
+            print(
+                f"{bench['name']:36s} {bench['param']:>8s}={_label(value):<10s}"
+                f" {seconds * 1000:12.3f} ms",
+                flush=True,
+            )
+        slope = scaling(points)
+        for result in results[-len(points) :]:
+            result["scaling"] = slope
+        if slope is not None:
+            print(f"{bench['name']:36s} scaling exponent {slope:.2f}", flush=True)
+    return results
+
+
+def compare(results, baseline, tolerance=0.25):
+    """Benchmarks that got slower than a baseline by more than tolerance
+
+    Returns:
+        list of tuple: (name, value, baseline seconds, seconds)
+    """
+    previous = {(r["name"], r["value"]): r["seconds"] for r in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get((result["name"], result["value"]))
+        if before and result["seconds"] > before * (1 + tolerance):
+            regressions.append(
+                (result["name"], result["value"], before, result["seconds"])
+            )
+    return regressions
+
+
+def main(argv=None):
+    global latency
+
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "names", nargs="*", help="only run benchmarks matching these patterns"
+    )
+    parser.add_argument("--quick", action="store_true", help="run smaller sizes")
+    parser.add_argument("--repeat", type=int, default=5, help="timing repeats")
+    parser.add_argument(
+        "--latency", type=float, default=0, help="milliseconds per GCS request"
+    )
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="results JSON file to compare against")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%"
+    )
+    parser.add_argument("--list", action="store_true", help="list the benchmarks")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for bench in BENCHMARKS:
+            print(f"{bench['name']:36s} {bench['func'].__doc__}")
+        return
+
+    latency = args.latency / 1000
+    results = run(args.names, args.quick, args.repeat)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "created": datetime.utcnow().isoformat(),
+                    "python": sys.version.split()[0],
+                    "numpy": np.__version__,
+                    "platform": platform.platform(),
+                    "latency": args.latency,
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        for name, value, before, after in regressions:
+            print(
+                f"REGRESSION {name} {value}: {before * 1000:.3f} ms -> "
+                f"{after * 1000:.3f} ms ({after / before - 1:+.0%})"
+            )
+        raise SystemExit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""Sampling of gridded HRRR fields at station locations
+
+Stations are mapped to grid cells in a single vectorized projection. The
+mapping only depends on the grid definition and the station coordinates, so it
+is cached and reused across hours and variables.
+"""
+from collections import OrderedDict
+
+import numpy as np
+from scipy import sparse
+
+# Number of (grid, station set) indices kept by grid_index and interpolator
+CACHE_SIZE = 64
+
+METHODS = ("nearest", "bilinear", "idw")
+
+_cache = OrderedDict()
+
+
+class GridIndex:
+    def __init__(self, grid, lat, lon):
+        """Nearest grid cell of each station
+
+        Stations outside of the grid are matched to the closest edge cell,
+        and flagged in the inside attribute.
+
+        Args:
+            grid (arl.ARLGrid): grid definition
+            lat (array-like): station latitudes in degrees
+            lon (array-like): station longitudes in degrees
+        """
+        x, y = grid.xy(lat, lon)
+        col = np.rint(x).astype(np.intp)
+        row = np.rint(y).astype(np.intp)
+        self.inside = (col >= 0) & (col < grid.nx) & (row >= 0) & (row < grid.ny)
+        self.col = np.clip(col, 0, grid.nx - 1)
+        self.row = np.clip(row, 0, grid.ny - 1)
+        self.angle = np.deg2rad(grid.convergence(lon))
+        self.grid = grid
+
+    def __len__(self):
+        return len(self.col)
+
+    def sample(self, field):
+        """Values of a (ny, nx) field, or (..., ny, nx) stack, at each station"""
+        return np.asarray(field)[..., self.row, self.col]
+
+
+class PointInterpolator:
+    def __init__(self, grid, lat, lon, method: str = "bilinear", k: int = 4, power=2):
+        """Interpolation of gridded fields to station locations
+
+        The interpolation weights are computed once and stored as a sparse
+        (stations, ny * nx) CSR matrix. Interpolating a field only gathers the
+        cells with a weight, so its cost depends on the number of stations
+        rather than the size of the grid.
+
+        Args:
+            grid (arl.ARLGrid): grid definition
+            lat (array-like): station latitudes in degrees
+            lon (array-like): station longitudes in degrees
+            method (str): "bilinear" between the four surrounding cells, or
+                "idw" for inverse distance weighting of the k nearest cells
+            k (int): number of cells used by "idw"
+            power (float): exponent of the inverse distance used by "idw"
+        """
+        x, y = grid.xy(lat, lon)
+        x = np.clip(np.atleast_1d(x), 0, grid.nx - 1)
+        y = np.clip(np.atleast_1d(y), 0, grid.ny - 1)
+
+        if method == "bilinear":
+            cols, rows, weights = self._bilinear(grid, x, y)
+        elif method == "idw":
+            cols, rows, weights = self._idw(grid, x, y, k, power)
+        else:
+            raise ValueError(f"method must be one of {METHODS}")
+
+        stations = np.broadcast_to(np.arange(len(x))[:, None], weights.shape)
+        self.weights = sparse.csr_matrix(
+            (weights.ravel(), (stations.ravel(), (rows * grid.nx + cols).ravel())),
+            shape=(len(x), grid.nx * grid.ny),
+        )
+        self.angle = np.deg2rad(grid.convergence(np.atleast_1d(lon)))
+        self.grid = grid
+        self.method = method
+
+    @staticmethod
+    def _bilinear(grid, x, y):
+        col = np.minimum(np.floor(x).astype(np.intp), max(grid.nx - 2, 0))
+        row = np.minimum(np.floor(y).astype(np.intp), max(grid.ny - 2, 0))
+        fx = x - col
+        fy = y - row
+        cols = np.stack([col, col + 1, col, col + 1], axis=1)
+        rows = np.stack([row, row, row + 1, row + 1], axis=1)
+        weights = np.stack(
+            [(1 - fx) * (1 - fy), fx * (1 - fy), (1 - fx) * fy, fx * fy], axis=1
+        )
+        return (
+            np.minimum(cols, grid.nx - 1),
+            np.minimum(rows, grid.ny - 1),
+            weights,
+        )
+
+    @staticmethod
+    def _idw(grid, x, y, k, power):
+        # Candidate cells in a window around each station that is large enough
+        # to contain its k nearest cells
+        r = int(np.ceil(np.sqrt(k)))
+        offsets = np.arange(-r + 1, r + 1)
+        dx, dy = [o.ravel() for o in np.meshgrid(offsets, offsets)]
+        cols = np.floor(x)[:, None].astype(np.intp) + dx
+        rows = np.floor(y)[:, None].astype(np.intp) + dy
+        distance = np.hypot(cols - x[:, None], rows - y[:, None])
+        # Candidates off the grid are never among the nearest, rather than
+        # clipped onto the edge where they would repeat an edge cell
+        outside = (cols < 0) | (cols >= grid.nx) | (rows < 0) | (rows >= grid.ny)
+        distance[outside] = np.inf
+        cols = np.clip(cols, 0, grid.nx - 1)
+        rows = np.clip(rows, 0, grid.ny - 1)
+
+        nearest = np.argpartition(distance, k - 1, axis=1)[:, :k]
+        cols = np.take_along_axis(cols, nearest, axis=1)
+        rows = np.take_along_axis(rows, nearest, axis=1)
+        distance = np.take_along_axis(distance, nearest, axis=1)
+
+        weights = 1 / np.maximum(distance, 1e-9) ** power
+        weights /= weights.sum(axis=1, keepdims=True)
+        return cols, rows, weights
+
+    def __len__(self):
+        return self.weights.shape[0]
+
+    def sample(self, field):
+        """Interpolated values of a (ny, nx) field, or (..., ny, nx) stack"""
+        field = np.asarray(field)
+        flat = field.reshape(field.shape[:-2] + (self.grid.ny * self.grid.nx,))
+        weights = self.weights
+        if len(self) == 0:
+            return np.zeros(field.shape[:-2] + (0,))
+        # Gather the cells of each station and sum them, rather than a sparse
+        # product with the whole grid, which upcasts and copies float32 fields.
+        # Every station has at least one cell, so no row of weights is empty.
+        return np.add.reduceat(
+            flat[..., weights.indices] * weights.data, weights.indptr[:-1], axis=-1
+        )
+
+
+def _cached(key, factory):
+    try:
+        _cache.move_to_end(key)
+        return _cache[key]
+    except KeyError:
+        pass
+
+    value = factory()
+    _cache[key] = value
+    if len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return value
+
+
+def grid_index(grid, lat, lon) -> GridIndex:
+    """Cached GridIndex for a grid definition and set of station coordinates"""
+    lat = np.ascontiguousarray(lat, dtype=float)
+    lon = np.ascontiguousarray(lon, dtype=float)
+    key = (grid.key, lat.tobytes(), lon.tobytes())
+    return _cached(key, lambda: GridIndex(grid, lat, lon))
+
+
+def interpolator(grid, lat, lon, method: str = "nearest", **kwargs):
+    """Cached sampler for a grid definition, set of stations and method
+
+    Args:
+        grid (arl.ARLGrid): grid definition
+        lat (array-like): station latitudes in degrees
+        lon (array-like): station longitudes in degrees
+        method (str): "nearest", "bilinear" or "idw"
+        **kwargs: passed to PointInterpolator
+
+    Returns:
+        GridIndex or PointInterpolator: object with a sample(field) method
+    """
+    if method == "nearest":
+        return grid_index(grid, lat, lon)
+    lat = np.ascontiguousarray(lat, dtype=float)
+    lon = np.ascontiguousarray(lon, dtype=float)
+    key = (
+        grid.key,
+        lat.tobytes(),
+        lon.tobytes(),
+        method,
+        tuple(sorted(kwargs.items())),
+    )
+    return _cached(key, lambda: PointInterpolator(grid, lat, lon, method, **kwargs))
+
+
+def wind_speed_direction(u, v):
+    """Wind speed and direction (degrees) from u and v components"""
+    u = np.asarray(u)
+    v = np.asarray(v)
+    ws = np.sqrt(u**2 + v**2)
+    wd = np.mod(180 + np.rad2deg(np.arctan2(v, u)), 360)
+    return ws, wd
+
+
+def extract_wind(u, v, index):
+    """Wind speed and direction at each station of a GridIndex
+
+    Only the u and v values at the sampled cells are converted, rather than
+    the whole grid. With a PointInterpolator the wind components are
+    interpolated before being converted. The grid-relative components are
+    rotated to true north at each station, see arl.ARLGrid.convergence.
+
+    Args:
+        u (np.ndarray): (ny, nx) grid-relative u wind component
+        v (np.ndarray): (ny, nx) grid-relative v wind component
+        index (GridIndex or PointInterpolator): station to grid mapping
+
+    Returns:
+        tuple of np.ndarray: (ws, wd) at each station
+    """
+    u = index.sample(u)
+    v = index.sample(v)
+    cos = np.cos(index.angle)
+    sin = np.sin(index.angle)
+    return wind_speed_direction(cos * u + sin * v, cos * v - sin * u)
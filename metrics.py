@@ -0,0 +1,249 @@
+"""Timing spans, counters and peak memory of evaluation runs
+
+A Run records how long each stage took, how much was downloaded and how many
+stations were evaluated:
+
+    with Run("evaluate", hour=mDATE) as run:
+        with span("fetch_obs"):
+            ...
+        add("stations", len(table))
+    run.write(export)
+
+span and add record into the runs active in the current context, so modules
+such as GoogleCloudStorage.py and MesoWest_BB.py can count the bytes they
+download without being handed a run. The active runs are kept in a
+contextvars.ContextVar, so runs evaluated concurrently in other threads (e.g.
+the watcher with more than one worker) don't record each other's stages.
+Threads don't inherit the context, so functions handed to a thread pool by a
+stage are wrapped with bind() to be counted in the stage's run. With no active
+run, recording does nothing.
+
+Only the standard library is used, so importing this module is cheap.
+"""
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Prefix of the Prometheus metric names
+NAMESPACE = "model_eval"
+
+_lock = threading.Lock()
+# Runs active in the current context, innermost last
+_active = contextvars.ContextVar("active_runs", default=())
+
+
+def peak_rss():
+    """Peak resident set size of the process in bytes, or None if unknown
+
+    This is the peak over the life of the process, not of a single run.
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+class Run:
+    def __init__(self, name: str, hour: datetime = None, **labels):
+        """Instrumentation of a single evaluation run
+
+        Args:
+            name (str): kind of run, e.g. "evaluate" or "evaluate_leads"
+            hour (datetime, optional): hour or cycle evaluated, in UTC
+            **labels: other identifiers of the run, e.g. region
+        """
+        self.name = name
+        self.hour = hour
+        self.labels = labels
+        self.stages = {}
+        self.counters = {}
+        self.started = None
+        self.seconds = None
+        self.error = None
+        self.rss_growth = None
+        self._start = None
+        self._rss = None
+        self._token = None
+
+    def __enter__(self):
+        self.started = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+        self._rss = peak_rss()
+        self._token = _active.set(_active.get() + (self,))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _active.reset(self._token)
+        self.seconds = time.perf_counter() - self._start
+        if self._rss is not None:
+            self.rss_growth = peak_rss() - self._rss
+        if exc is not None:
+            self.error = repr(exc)
+
+    def _span(self, name: str, seconds: float):
+        # Stages that run several times, or concurrently, report how many times
+        # they ran and the sum of their durations
+        stage = self.stages.setdefault(name, {"count": 0, "seconds": 0.0})
+        stage["count"] += 1
+        stage["seconds"] += seconds
+
+    @property
+    def id(self):
+        """Name of the run's files, e.g. evaluate_2021012007"""
+        parts = [self.name]
+        if self.hour is not None:
+            parts.append(f"{self.hour:%Y%m%d%H}")
+        parts.extend(str(v) for v in self.labels.values())
+        return "_".join(parts)
+
+    def to_dict(self):
+        """Summary of the run, as written by write()"""
+        return {
+            "run": self.name,
+            "hour": None if self.hour is None else f"{self.hour:%Y%m%d%H}",
+            **self.labels,
+            "started": self.started and self.started.isoformat(),
+            "seconds": self.seconds,
+            "status": "error" if self.error else "ok",
+            "error": self.error,
+            "stages": self.stages,
+            "counters": self.counters,
+            # The process peak covers every earlier run of a long-lived
+            # process (e.g. watch), so a run's own memory shows as the growth
+            # of the peak while it ran. It is 0 for a run that stayed below
+            # an earlier peak, and approximate for concurrent runs.
+            "process_peak_rss_bytes": peak_rss(),
+            "peak_rss_growth_bytes": self.rss_growth,
+            "pid": os.getpid(),
+        }
+
+    def prometheus(self):
+        """Summary of the run in the Prometheus text exposition format"""
+        labels = {"run": self.name, **{k: str(v) for k, v in self.labels.items()}}
+
+        def line(metric, value, **extra):
+            # Label values are names and identifiers, which need no escaping
+            label = ",".join(f'{k}="{v}"' for k, v in {**labels, **extra}.items())
+            return f"{NAMESPACE}_{metric}{{{label}}} {value}"
+
+        summary = self.to_dict()
+        lines = [
+            f"# TYPE {NAMESPACE}_last_run_timestamp_seconds gauge",
+            line("last_run_timestamp_seconds", self.started.timestamp()),
+            f"# TYPE {NAMESPACE}_run_seconds gauge",
+            line("run_seconds", self.seconds),
+            f"# TYPE {NAMESPACE}_run_success gauge",
+            line("run_success", int(self.error is None)),
+            f"# TYPE {NAMESPACE}_stage_seconds gauge",
+            *(
+                line("stage_seconds", stage["seconds"], stage=name)
+                for name, stage in self.stages.items()
+            ),
+        ]
+        for name, value in self.counters.items():
+            lines += [f"# TYPE {NAMESPACE}_{name} gauge", line(name, value)]
+        for name in ("process_peak_rss_bytes", "peak_rss_growth_bytes"):
+            if summary[name] is not None:
+                lines += [f"# TYPE {NAMESPACE}_{name} gauge", line(name, summary[name])]
+        return "\n".join(lines) + "\n"
+
+    def write(self, export: str = "export", textfile: str = None):
+        """Write the summary of the run as JSON, and optionally for Prometheus
+
+        The JSON is written to $METRICS_DIR, by default {export}/metrics, as
+        {id}.json. The Prometheus textfile (e.g. for node_exporter's textfile
+        collector) is written to textfile, by default $METRICS_TEXTFILE, and
+        replaced by each run. Both are written atomically.
+
+        Returns:
+            str: path of the JSON file
+        """
+        directory = os.getenv("METRICS_DIR", os.path.join(export, "metrics"))
+        path = os.path.join(directory, f"{self.id}.json")
+        _write(path, json.dumps(self.to_dict(), indent=2))
+
+        textfile = textfile or os.getenv("METRICS_TEXTFILE")
+        if textfile:
+            _write(textfile, self.prometheus())
+        return path
+
+
+def _write(path, text):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+@contextmanager
+def record(export: str, name: str, hour: datetime = None, **labels):
+    """Instrument a run, and write its summary once it ends, even if it fails
+
+    Args:
+        export (str): output directory, see Run.write
+        name, hour, **labels: see Run
+
+    Yields:
+        Run: the active run
+    """
+    run = Run(name, hour, **labels)
+    try:
+        with run:
+            yield run
+    finally:
+        run.write(export)
+
+
+@contextmanager
+def span(name: str):
+    """Time a stage of the active runs"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        # A run's stages can be recorded from several threads of its pools
+        with _lock:
+            for run in _active.get():
+                run._span(name, seconds)
+
+
+def add(name: str, value=1):
+    """Add value to a counter of the active runs, e.g. bytes downloaded"""
+    with _lock:
+        for run in _active.get():
+            run.counters[name] = run.counters.get(name, 0) + value
+
+
+def bind(func):
+    """Wrap func to run in a copy of the current context
+
+    Functions submitted to a thread pool otherwise run in the context of the
+    pool's thread, and what they record is lost, or attributed to another run.
+    Each call gets its own copy, so the wrapper can run in several threads at
+    once.
+
+    Args:
+        func (callable): function to run, e.g. in ThreadPoolExecutor.map
+
+    Returns:
+        callable: func, recording into the runs active where bind was called
+    """
+    context = contextvars.copy_context()
+
+    def bound(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+
+    return bound
@@ -0,0 +1,41 @@
+"""
+Evaluation of HRRR surface winds against MesoWest observations.
+
+The pipeline stages, and the functions that run them, can be imported from the
+package:
+
+    from model_eval import fetch_obs, fetch_model, extract, score, write
+
+See model_eval.pipeline. Names are resolved on first use, so importing the
+package doesn't import pandas, scipy, pyarrow or the Google Cloud client.
+Run python -m model_eval --help for the command line interface.
+"""
+import importlib
+
+__all__ = [
+    "fetch_obs",
+    "fetch_model",
+    "extract",
+    "score",
+    "write",
+    "compare",
+    "evaluate",
+    "evaluate_leads",
+    "evaluate_regions",
+    "load_config",
+    "backfill",
+    "watch",
+    "main",
+]
+
+
+def __getattr__(name):
+    if name == "main":
+        return importlib.import_module("model_eval.cli").main
+    if name in __all__:
+        return getattr(importlib.import_module("model_eval.pipeline"), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
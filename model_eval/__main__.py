@@ -0,0 +1,3 @@
+from model_eval.cli import main
+
+main()
@@ -0,0 +1,190 @@
+"""
+Command line interface of the HRRR evaluation pipeline.
+
+Run without arguments to evaluate the most recent hour of HRRR data available in the
+GCS bucket, or with --start and --end to backfill a range of hours in parallel. With
+--watch, keep running and evaluate each new cycle as soon as it lands in the bucket.
+With --leads every forecast lead time in each cycle file is evaluated. With --config,
+evaluate every region of a multi-region config from the CONUS HRRR files instead, for
+a single hour and without --leads.
+
+--health reports how long the pipeline takes to import, without evaluating anything.
+"""
+import argparse
+import importlib
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+# Time the CLI was imported, the start of a cold start
+_started = time.perf_counter()
+
+# Modules imported by the pipeline stages, in the order they are first needed
+DEPENDENCIES = (
+    "numpy",
+    "pandas",
+    "scipy.spatial",
+    "requests",
+    "google.cloud.storage",
+    "pyarrow.dataset",
+    "MesoWest_BB",
+    "GoogleCloudStorage",
+    "arl",
+    "extract",
+    "results",
+    "stats",
+)
+
+
+def health():
+    """Import time of the pipeline and of each of its dependencies
+
+    Modules already imported by the process are reported as taking no time, so
+    the numbers are only meaningful from a fresh interpreter, e.g.
+    python -m model_eval --health.
+
+    Returns:
+        dict: "ok", "token" (whether MESOWEST_TOKEN is set), "imports" with the
+            seconds taken by each dependency or its import error, and
+            "cold_start" with the seconds from the CLI being imported to the
+            whole pipeline being ready to run
+    """
+    start = time.perf_counter()
+    importlib.import_module("model_eval.pipeline")
+    imports = {"model_eval.pipeline": round(time.perf_counter() - start, 4)}
+
+    ok = True
+    for name in DEPENDENCIES:
+        t = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            imports[name] = repr(e)
+            ok = False
+            continue
+        imports[name] = round(time.perf_counter() - t, 4)
+
+    token = bool(os.getenv("MESOWEST_TOKEN"))
+    return {
+        "ok": ok and token,
+        "token": token,
+        "imports": imports,
+        "cold_start": round(time.perf_counter() - _started, 4),
+    }
+
+
+def _parse_hour(value):
+    from model_eval.pipeline import utc
+
+    return utc.localize(datetime.strptime(value, "%Y%m%d%H"))
+
+
+def parser(config=None):
+    """Argument parser of the CLI, with config as the default of --config"""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--start", type=_parse_hour, help="first hour, YYYYMMDDHH UTC")
+    parser.add_argument("--end", type=_parse_hour, help="last hour, YYYYMMDDHH UTC")
+    parser.add_argument(
+        "--hour", type=_parse_hour, help="hour to evaluate, YYYYMMDDHH UTC"
+    )
+    parser.add_argument("--workers", type=int, help="number of backfill processes")
+    parser.add_argument("--export", default="export", help="output directory")
+    parser.add_argument(
+        "--leads", action="store_true", help="evaluate every lead time of each cycle"
+    )
+    parser.add_argument(
+        "--watch", action="store_true", help="evaluate new cycles as they land"
+    )
+    parser.add_argument(
+        "--poll", type=float, default=60, help="seconds between bucket listings"
+    )
+    parser.add_argument(
+        "--config", default=config, help="evaluate the regions of a config file"
+    )
+    parser.add_argument(
+        "--region", action="append", help="only evaluate this region, repeatable"
+    )
+    parser.add_argument(
+        "--health", action="store_true", help="report import times and exit"
+    )
+    return parser
+
+
+def main(argv=None, config=None):
+    """Run the pipeline from command line arguments
+
+    Args:
+        argv (list of str, optional): arguments. Defaults to sys.argv[1:].
+        config (str, optional): default --config. Without a config the SLC
+            subset is evaluated.
+    """
+    cli = parser(config)
+    args = cli.parse_args(argv)
+
+    # Reject flags that would otherwise be silently ignored
+    if args.end and not args.start:
+        cli.error("--end requires --start")
+    if args.region and not args.config:
+        cli.error("--region requires --config")
+    if args.config and (args.leads or args.start or args.watch):
+        cli.error(
+            f"--leads, --start and --watch can't be used with --config {args.config}"
+        )
+
+    if args.health:
+        report = health()
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        raise SystemExit(0 if report["ok"] else 1)
+
+    from model_eval import pipeline
+
+    if args.watch:
+        logging.basicConfig(
+            level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+        )
+        pipeline.watch(args.export, args.leads, args.poll, args.workers or 1)
+        return
+
+    if args.start:
+        results = pipeline.backfill(
+            args.start, args.end or args.start, args.workers, args.export, args.leads
+        )
+        failed = [(hour, error) for hour, _, error in results if error]
+        for hour, error in failed:
+            print(f"{hour:%Y%m%d%H} failed: {error}")
+        print(f"Evaluated {len(results) - len(failed)} of {len(results)} hours")
+        raise SystemExit(1 if failed else 0)
+
+    mDATE = args.hour
+    if mDATE is None:
+        # all datetimes in UTC
+        cDATE = pipeline.utc.localize(datetime.now()) - timedelta(hours=4)
+        ## NOTE: I'm setting a time delta of -4, to match with the most recent hour of HRRR data available in the GCS Bucket. Remove if real time data as per UTC becomes available
+        print(cDATE)
+
+        mDATE = cDATE.replace(minute=0, second=0, microsecond=0)
+    print(mDATE)
+
+    if args.config:
+        config = pipeline.load_config(args.config)
+        if args.region:
+            config["regions"] = [
+                r for r in config["regions"] if r["name"] in args.region
+            ]
+        results = pipeline.evaluate_regions(mDATE, config, args.export)
+        for name, result in results.items():
+            print(f"{name}: {result}")
+        raise SystemExit(
+            1 if any(isinstance(r, Exception) for r in results.values()) else 0
+        )
+
+    if args.leads:
+        print(pipeline.evaluate_leads(mDATE, args.export))
+    else:
+        pipeline.evaluate(mDATE, args.export)
@@ -0,0 +1,527 @@
+"""
+Stages of the HRRR evaluation pipeline, and the ways of running them.
+
+An hour is evaluated by chaining five stages:
+
+    obs = fetch_obs(hour, region)        # MesoWest observations
+    u, v, grid = fetch_model(hour)       # HRRR 10 m winds
+    ws, wd = extract(obs, u, v, grid)    # HRRR winds at the MesoWest sites
+    table = score(obs, ws, wd)           # errors at each site
+    write(table, hour, export)           # results store, statistics and JSON
+
+evaluate, evaluate_leads, evaluate_regions, backfill and watch run them for a
+single hour, every lead time of a cycle, several regions, a range of hours and
+new cycles as they land. Heavy dependencies (pandas, the Google Cloud client,
+pyarrow, scipy) are imported by the stages that use them, so importing this
+module is cheap.
+"""
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from pytz import timezone
+
+import metrics
+
+hrrr_vars = "wind_direction," + "wind_speed," + "air_temp"
+
+# Bucket and folder of the HRRR SLC subset
+BUCKET = "air-tracker-edf-stilt-meteorology-prod"
+SUBSET = "-112.6_-111.4_40.0_41.3/"
+
+utc = timezone("UTC")
+
+# Cycles older than this are no longer republished, so their cached ARL files
+# are used without looking up the current generation in the bucket
+CYCLE_SETTLE = timedelta(days=1)
+
+# MesoWest sites compared with the SLC subset: within 20 miles of the center
+SLC = {"name": "slc", "center": "40.65,-112.0", "radius": 20}
+
+# Default config of evaluate_regions
+CONFIG = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "regions.json"
+)
+
+_bucket = None
+
+
+def get_bucket():
+    """Connection to the HRRR bucket, shared by every hour evaluated in a process"""
+    from GoogleCloudStorage import BlobCache, GoogleCloudStorageBucket
+
+    global _bucket
+    if _bucket is None:
+        # ARL files are cached locally (keyed by their GCS generation) so reruns and
+        # backfills of the same cycle don't download them again. Setting
+        # HRRR_CACHE_DIR to an empty string disables the cache, and files are read
+        # into memory instead, without touching the disk.
+        cache = None
+        if os.getenv("HRRR_CACHE_DIR", "/tmp/hrrr-cache"):
+            cache = BlobCache(
+                os.getenv("HRRR_CACHE_DIR", "/tmp/hrrr-cache"),
+                max_bytes=int(os.getenv("HRRR_CACHE_BYTES", 10 * 1024**3)),
+            )
+        _bucket = GoogleCloudStorageBucket(
+            BUCKET, cache=cache
+        )  # This has the HRRR SLC Subset Data
+    return _bucket
+
+
+def cycle_filename(mDATE):
+    """Path of the ARL file of the HRRR cycle starting at mDATE in the bucket"""
+    dat = mDATE.strftime("%Y%m%d")
+
+    # hrrr_hour = int(mDATE.hour / 6) * 6
+    hrrr_hour = int(mDATE.hour)
+    # The above variables are manipulated to match the HRRR Reanalysis filename format
+
+    # filename = f'-112.6_-111.4_40.0_41.3/{hrrr_time}_{hrrr_hour:02}-{hrrr_endhour:02}_hrrr'
+    return f"{SUBSET}{dat}/hysplit.t{hrrr_hour:02}z.hrrrf"
+
+
+def get_cycle(mDATE):
+    """ARL file of an HRRR cycle, as a cached local path or in memory"""
+    bucket = get_bucket()
+    if bucket.cache is None:
+        return bucket.read(cycle_filename(mDATE))
+    cycle = mDATE if mDATE.tzinfo else utc.localize(mDATE)
+    settled = datetime.now(utc) - cycle > CYCLE_SETTLE
+    return bucket.fetch(cycle_filename(mDATE), revalidate=not settled)
+
+
+# Function to fine tune wind speed difference
+def wdcorr(x):
+    return (360 - abs(x)) if (abs(x) > 180) else abs(x)
+
+
+def fetch_obs(mDATE, region=SLC, verbose=True):
+    """MesoWest observations of a region at a given time
+
+    Args:
+        mDATE (datetime): time of the observations, in UTC
+        region (dict): either a "center" ("lat,lon") and "radius" in miles, or
+            a "bbox" (lon_min, lat_min, lon_max, lat_max). Defaults to the area
+            around Salt Lake City.
+        verbose (bool): print diagnostics
+
+    Returns:
+        dict: station columns, see get_mesowest_radius
+    """
+    from MesoWest_BB import get_mesowest_bbox, get_mesowest_radius
+
+    with metrics.span("fetch_obs"):
+        if "bbox" in region:
+            mwm = get_mesowest_bbox(
+                mDATE,
+                region["bbox"],
+                variables=hrrr_vars,
+                extra="",
+                set_num=0,
+                verbose=verbose,
+            )
+        else:
+            mwm = get_mesowest_radius(
+                mDATE,
+                region["center"],
+                str(region["radius"]),
+                variables=hrrr_vars,
+                extra="",
+                set_num=0,
+                verbose=verbose,
+            )
+
+    if mwm == "ERROR":
+        # retry?
+        raise FileNotFoundError(
+            "Error fetching MesoWest data. Exiting the program..."
+        )  # Error catching
+    return mwm
+
+
+def fetch_model(mDATE, bucket=None, filename=None):
+    """HRRR ground level u & v wind components for an hour
+
+    Args:
+        mDATE (datetime): valid time, in UTC
+        bucket (GoogleCloudStorageBucket, optional): bucket to read filename
+            from with byte-range requests, e.g. for the ~10GB CONUS files.
+            Defaults to the cached or in memory SLC subset, see get_cycle.
+        filename (str, optional): name of the ARL file in bucket
+
+    Returns:
+        tuple: (u, v, grid), see arl.read_wind. Rows of the arrays run south
+            to north on the HRRR grid.
+    """
+    from arl import read_wind
+
+    with metrics.span("fetch_model"):
+        if bucket is None:
+            with metrics.span("download"):
+                arl_file = get_cycle(mDATE)
+            return read_wind(arl_file, mDATE)
+        with bucket.open(filename) as arl_file:
+            return read_wind(arl_file, mDATE)
+
+
+def extract(mwm, u, v, grid):
+    """HRRR wind speed and direction at each MesoWest site
+
+    By default the nearest HRRR grid point to each site is used; set
+    HRRR_INTERPOLATION to "bilinear" or "idw" to interpolate instead. The site
+    to grid mapping is cached, and ws/wd are only calculated at the sites.
+
+    Args:
+        mwm (dict): MesoWest observations, see fetch_obs
+        u (np.ndarray): (ny, nx) HRRR u wind component
+        v (np.ndarray): (ny, nx) HRRR v wind component
+        grid (arl.ARLGrid): grid of u and v
+
+    Returns:
+        tuple of np.ndarray: (ws, wd) at each site
+    """
+    from extract import extract_wind, interpolator
+
+    with metrics.span("extract"):
+        index = interpolator(
+            grid,
+            mwm["LAT"],
+            mwm["LON"],
+            method=os.getenv("HRRR_INTERPOLATION", "nearest"),
+        )
+        return extract_wind(u, v, index)
+
+
+def score(mwm, ws_hrrr, wd_hrrr):
+    """Table of measured and modeled wind, and their difference, at each site
+
+    Args:
+        mwm (dict): MesoWest observations, see fetch_obs
+        ws_hrrr (np.ndarray): HRRR wind speed at each site
+        wd_hrrr (np.ndarray): HRRR wind direction at each site
+
+    Returns:
+        pd.DataFrame: one row per site
+    """
+    import numpy as np
+    import pandas as pd
+
+    with metrics.span("score"):
+        # Defining an empty data frame to store the final MW and HRRR raw values for Windspeed and Wind Direction
+
+        master_df = pd.DataFrame()
+
+        master_df["STID"] = mwm["STID"]
+        master_df["LAT"] = mwm["LAT"]
+        master_df["LON"] = mwm["LON"]
+
+        master_df["MW_ws"] = mwm["wind_speed"]
+        master_df["MW_wd"] = mwm["wind_direction"]
+
+        master_df["HRRR_ws"] = ws_hrrr
+        master_df["HRRR_wd"] = wd_hrrr
+
+        # calculates ws/wd error (Mesowest measured ws/wd minus HRRR modeled ws/wd) and adds to data dictionary
+        master_df["wsdiff"] = abs(master_df["MW_ws"] - master_df["HRRR_ws"])
+        master_df["wddiff"] = abs(master_df["MW_wd"] - master_df["HRRR_wd"])
+
+        wdcorr_func = np.vectorize(wdcorr)
+        master_df["wddiff"] = wdcorr_func(master_df["wddiff"])
+
+    metrics.add("stations", len(master_df))
+    metrics.add("stations_compared", int(master_df["wsdiff"].count()))
+    return master_df
+
+
+def compare(mwm, u, v, grid):
+    """Table of measured and modeled wind at each MesoWest site, see score()"""
+    return score(mwm, *extract(mwm, u, v, grid))
+
+
+def write_json(records, path):
+    """Write records to a JSON file
+
+    The file is written to a temporary file first so that concurrent runs
+    never see a partial output file.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as outfile:
+        json.dump(records, outfile, indent=2)
+    os.replace(tmp, path)
+    return path
+
+
+def write(master_df, time, export="export", name=None, region="slc", lead=0):
+    """Append a comparison table to the results store, and write its JSON view
+
+    The results are stored in a Parquet dataset in $RESULTS_STORE, by default
+    {export}/results, see results.ResultStore, and added to the running
+    statistics in $STATS_DB, by default {export}/stats.sqlite, see
+    stats.StatsStore. The table is also written to {export}/{name} as JSON
+    unless $EXPORT_JSON is 0.
+
+    Args:
+        master_df (pd.DataFrame): table from score()
+        time (datetime): valid time, in UTC
+        export (str): output directory
+        name (str, optional): path of the JSON view relative to export.
+            Defaults to ME{YYYYMMDDHH}.json.
+        region (str): name of the evaluated region
+        lead (int): forecast lead time in hours
+
+    Returns:
+        str: path of the JSON file, or of the Parquet file without JSON
+    """
+    from results import ResultStore
+    from stats import StatsStore
+
+    name = name or f"ME{time:%Y%m%d%H}.json"
+    with metrics.span("write_results"):
+        store = ResultStore(os.getenv("RESULTS_STORE", os.path.join(export, "results")))
+        path = store.append(master_df, time, region=region, lead=lead)
+    with metrics.span("write_stats"):
+        stats = StatsStore(os.getenv("STATS_DB", os.path.join(export, "stats.sqlite")))
+        stats.update(master_df, time, region=region, lead=lead)
+    if os.getenv("EXPORT_JSON", "1") != "0":
+        with metrics.span("write_json"):
+            records = master_df.to_dict("records")
+            path = write_json(records, os.path.join(export, name))
+    return path
+
+
+def evaluate(mDATE, export="export", verbose=True):
+    """Compare HRRR and MesoWest winds for a single hour
+
+    Args:
+        mDATE (datetime): top of the hour to evaluate, in UTC
+        export (str): directory the output is written to, see write()
+        verbose (bool): print diagnostics
+
+    Returns:
+        str: path to the output file
+    """
+    with metrics.record(export, "evaluate", mDATE):
+        mwm = fetch_obs(mDATE, verbose=verbose)
+        u, v, grid = fetch_model(mDATE)
+        return write(compare(mwm, u, v, grid), mDATE, export)
+
+
+def evaluate_leads(mDATE, export="export", verbose=True):
+    """Compare every forecast lead time of an HRRR cycle with MesoWest
+
+    The cycle file is downloaded and decoded once, and the observations for
+    each valid time are fetched concurrently. Lead times that are not yet
+    observed, or whose observations can't be fetched, are skipped.
+
+    Args:
+        mDATE (datetime): start of the HRRR cycle, in UTC
+        export (str): directory the output is written to. The table of each
+            lead time is saved with its lead time (see write()), with a JSON
+            view in ME{YYYYMMDDHH}_f{lead}.json, and the mean errors of every
+            lead time are written to ME{YYYYMMDDHH}_leads.json.
+        verbose (bool): print diagnostics
+
+    Returns:
+        pd.DataFrame: mean errors with one row per evaluated lead time
+    """
+    import pandas as pd
+    from requests import RequestException
+
+    from arl import read_winds
+
+    with metrics.record(export, "evaluate_leads", mDATE):
+        cycle = mDATE.astimezone(utc).replace(tzinfo=None)
+        with metrics.span("fetch_model"):
+            with metrics.span("download"):
+                arl_file = get_cycle(mDATE)
+            times, u, v, grid = read_winds(arl_file, cycle, datetime.utcnow())
+
+        def observe(time):
+            # MesoWest errors, and requests that failed after retrying, skip the
+            # lead time rather than the whole cycle
+            try:
+                return fetch_obs(utc.localize(time), verbose=verbose)
+            except (FileNotFoundError, RequestException) as e:
+                if verbose:
+                    print(f"  !! MesoWest request for {time} failed: {e!r}")
+                return None
+
+        with ThreadPoolExecutor(max(len(times), 1)) as pool:
+            observations = list(pool.map(metrics.bind(observe), times))
+
+        dat2 = mDATE.strftime("%Y%m%d%H")
+        summary = []
+        for time, mwm, u_lead, v_lead in zip(times, observations, u, v):
+            lead = int((time - cycle).total_seconds() // 3600)
+            if mwm is None:
+                if verbose:
+                    print(f"  !! Skipping f{lead:02}: no MesoWest data for {time}")
+                continue
+            master_df = compare(mwm, u_lead, v_lead, grid)
+            write(master_df, time, export, f"ME{dat2}_f{lead:02}.json", lead=lead)
+            summary.append(
+                {
+                    "lead": lead,
+                    "valid": time.strftime("%Y%m%d%H"),
+                    "stations": int(master_df["wsdiff"].count()),
+                    "wsdiff": float(master_df["wsdiff"].mean()),
+                    "wddiff": float(master_df["wddiff"].mean()),
+                }
+            )
+
+        write_json(summary, os.path.join(export, f"ME{dat2}_leads.json"))
+        return pd.DataFrame(summary)
+
+
+def load_config(path=CONFIG):
+    """Read a multi-region config
+
+    The config holds the "bucket" with the CONUS ARL files, the "filename" of
+    each cycle as a format string of date, and a list of "regions". Each region
+    has a "name" and either a "center" ("lat,lon") and "radius" in miles, or a
+    "bbox" (lon_min, lat_min, lon_max, lat_max).
+    """
+    with open(path) as f:
+        return json.load(f)
+
+
+def evaluate_regions(mDATE, config, export="export", verbose=True):
+    """Compare HRRR and MesoWest winds for every region of a config
+
+    Each cycle the wind components are decoded from the CONUS file once, while
+    the MesoWest observations of every region are fetched concurrently, and the
+    decoded grid is then shared by the extraction of each region.
+
+    Args:
+        mDATE (datetime): top of the hour to evaluate, in UTC
+        config (dict): regions config, see load_config
+        export (str): the table of each region is written with its region
+            name, and to {export}/{region}/ME{YYYYMMDDHH}.json, see write()
+        verbose (bool): print diagnostics
+
+    Returns:
+        dict: output path of each region, or the error if it failed
+    """
+    from GoogleCloudStorage import GoogleCloudStorageBucket
+
+    with metrics.record(export, "evaluate_regions", mDATE):
+        regions = config["regions"]
+        bucket = GoogleCloudStorageBucket(config["bucket"])
+        filename = config["filename"].format(date=mDATE)
+
+        with ThreadPoolExecutor(max(len(regions), 1)) as pool:
+            observations = [
+                pool.submit(metrics.bind(fetch_obs), mDATE, region, verbose)
+                for region in regions
+            ]
+
+            # The CONUS ARL file is ~10GB, so rather than downloading it only the
+            # index and the ground level u & v wind records for the hour of interest
+            # are read from the bucket using byte-range requests, while the MesoWest
+            # queries run.
+            u, v, grid = fetch_model(mDATE, bucket, filename)
+
+            dat2 = mDATE.strftime("%Y%m%d%H")
+            results = {}
+            for region, future in zip(regions, observations):
+                # A region that fails, e.g. because its MesoWest request failed
+                # after retrying, doesn't stop the other regions being written
+                try:
+                    master_df = compare(future.result(), u, v, grid)
+                    results[region["name"]] = write(
+                        master_df,
+                        mDATE,
+                        export,
+                        os.path.join(region["name"], f"ME{dat2}.json"),
+                        region=region["name"],
+                    )
+                except Exception as e:
+                    results[region["name"]] = e
+        return results
+
+
+def _init_worker(scratch):
+    """Give each backfill worker process its own scratch directory"""
+    tempfile.tempdir = tempfile.mkdtemp(prefix=f"worker{os.getpid()}-", dir=scratch)
+    os.environ["TMPDIR"] = tempfile.tempdir
+
+
+def _evaluate_hour(args):
+    mDATE, export, leads = args
+    try:
+        if leads:
+            evaluate_leads(mDATE, export, verbose=False)
+            return mDATE, os.path.join(export, f"ME{mDATE:%Y%m%d%H}_leads.json"), None
+        return mDATE, evaluate(mDATE, export, verbose=False), None
+    except Exception as e:
+        return mDATE, None, repr(e)
+
+
+def backfill(start, end, workers=None, export="export", leads=False):
+    """Evaluate every hour from start to end, inclusive, on a pool of processes
+
+    Hours are handed to the workers in contiguous chunks. Each worker keeps its
+    GCS connection, MesoWest session and station to grid index cache across the
+    hours it evaluates, and has its own scratch directory.
+
+    Args:
+        start (datetime): first hour to evaluate, in UTC
+        end (datetime): last hour to evaluate, in UTC
+        workers (int, optional): number of processes. Defaults to the CPU count.
+        export (str): directory the output files are written to
+        leads (bool): evaluate every lead time of each cycle, see evaluate_leads
+
+    Returns:
+        list of tuples: (hour, output path or None, error message or None)
+    """
+    start = start.replace(minute=0, second=0, microsecond=0)
+    hours = []
+    while start <= end:
+        hours.append(start)
+        start += timedelta(hours=1)
+
+    workers = workers or os.cpu_count()
+    chunksize = max(1, len(hours) // (workers * 4))
+    with tempfile.TemporaryDirectory(prefix="backfill-") as scratch:
+        with ProcessPoolExecutor(
+            workers, initializer=_init_worker, initargs=(scratch,)
+        ) as pool:
+            return list(
+                pool.map(
+                    _evaluate_hour,
+                    [(hour, export, leads) for hour in hours],
+                    chunksize=chunksize,
+                )
+            )
+
+
+def watch(export="export", leads=False, poll=60, workers=1, stop=None):
+    """Evaluate each new HRRR cycle as soon as it appears in the bucket
+
+    The process stays warm between cycles, so the bucket connection, MesoWest
+    session and site to grid mapping are reused. Cycles that were evaluated
+    are recorded in {export}/watch.json and skipped on restart.
+
+    Args:
+        export (str): directory the output files are written to
+        leads (bool): evaluate every lead time of each cycle, see evaluate_leads
+        poll (float): seconds between listings of the bucket
+        workers (int): number of cycles evaluated concurrently
+        stop (threading.Event, optional): ends the watch once set
+    """
+    from watcher import CycleWatcher
+
+    def handler(cycle):
+        if leads:
+            evaluate_leads(utc.localize(cycle), export, verbose=False)
+        else:
+            evaluate(utc.localize(cycle), export, verbose=False)
+
+    os.makedirs(export, exist_ok=True)
+    watcher = CycleWatcher(
+        get_bucket(), SUBSET, handler, os.path.join(export, "watch.json"), poll=poll
+    )
+    watcher.run(workers=workers, stop=stop)
@@ -1,7 +1,7 @@
 import base64
 import copy
+import functools
 import io
-import tempfile
 import textwrap
 
 import numpy as np
@@ -31,12 +31,7 @@ def mercator_transform(data, lat_bounds, origin="upper", height_out=None):
     Originally from Folium
     Source: https://github.com/python-visualization/folium/blob/master/folium/utilities.py
     """
-    import numpy as np
-
-    def mercator(x):
-        return np.arcsinh(np.tan(x * np.pi / 180.0)) * 180.0 / np.pi
-
-    array = np.atleast_3d(data).copy()
+    array = np.atleast_3d(data)
     height, width, nblayers = array.shape
 
     lat_min = max(lat_bounds[0], -85.051128779806589)
@@ -48,17 +43,11 @@ def mercator_transform(data, lat_bounds, origin="upper", height_out=None):
     if origin == "upper":
         array = array[::-1, :, :]
 
-    lats = lat_min + np.linspace(0.5 / height, 1.0 - 0.5 / height, height) * (
-        lat_max - lat_min
+    lower, upper, weights = _mercator_weights(
+        float(lat_min), float(lat_max), int(height), int(height_out)
     )
-    latslats = mercator(lat_min) + np.linspace(
-        0.5 / height_out, 1.0 - 0.5 / height_out, height_out
-    ) * (mercator(lat_max) - mercator(lat_min))
-
-    out = np.zeros((height_out, width, nblayers))
-    for i in range(width):
-        for j in range(nblayers):
-            out[:, i, j] = np.interp(latslats, mercator(lats), array[:, i, j])
+    weights = weights[:, None, None]
+    out = array[lower] * (1 - weights) + array[upper] * weights
 
     # Eventually flip the image.
     if origin == "upper":
@@ -66,35 +55,115 @@ def mercator_transform(data, lat_bounds, origin="upper", height_out=None):
     return out
 
 
+def _mercator(x):
+    return np.arcsinh(np.tan(x * np.pi / 180.0)) * 180.0 / np.pi
+
+
+@functools.lru_cache(maxsize=64)
+def _mercator_weights(lat_min: float, lat_max: float, height: int, height_out: int):
+    """Rows and weights interpolating latitude rows onto Mercator rows
+
+    Output row i blends input rows lower[i] and upper[i] with weights
+    1 - weights[i] and weights[i]. This is the linear interpolation done by
+    np.interp, clamped to the first and last rows.
+    """
+    lats = lat_min + np.linspace(0.5 / height, 1.0 - 0.5 / height, height) * (
+        lat_max - lat_min
+    )
+    latslats = _mercator(lat_min) + np.linspace(
+        0.5 / height_out, 1.0 - 0.5 / height_out, height_out
+    ) * (_mercator(lat_max) - _mercator(lat_min))
+
+    source = _mercator(lats)
+    lower = np.searchsorted(source, latslats, side="right") - 1
+    lower = np.clip(lower, 0, max(height - 2, 0))
+    upper = np.minimum(lower + 1, height - 1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        weights = (latslats - source[lower]) / (source[upper] - source[lower])
+    weights = np.clip(np.nan_to_num(weights), 0, 1)
+    for a in (lower, upper, weights):
+        a.setflags(write=False)
+    return lower, upper, weights
+
+
 class Raster:
-    def __init__(self, path: str = None, buffer: io.BytesIO = None):
+    def __init__(
+        self,
+        path: str = None,
+        buffer: io.BytesIO = None,
+        variable: str = None,
+        extent: dict = None,
+        layers=None,
+        lazy: bool = False,
+        dtype=None,
+    ):
         """Representation of gridded 2 or 3 dimensional data
 
+        The data variable and its x, y and layers coordinates are identified
+        by their dimensions rather than by their position in the file. Only the
+        cells and layers requested are read, using netCDF hyperslab reads, and
+        with lazy=True nothing is read until the values are first accessed.
+
         Args:
             path (str, optional): path to netcdf file conforming to CF metadata
-                conventions. Must have dimensions ordered as (x, y, layers)
-                with a crs global attribute defining map projection
-            buffer (io.BytesIO, optional): in memory buffer streaming file data
+                conventions. The data variable must have dimensions ordered as
+                (layers, y, x) or (y, x), each with a coordinate variable, and
+                a crs global attribute defining map projection
+            buffer (io.BytesIO or bytes-like, optional): in memory file data,
+                opened through a memoryview without being copied. The buffer
+                must be left open while the raster is in use.
+            variable (str, optional): name of the data variable. Defaults to
+                the first variable with at least 2 dimensions that isn't a
+                coordinate variable.
+            extent (dict, optional): only read the cells intersecting this
+                window, with xmin, xmax, ymin and ymax keys in the coordinates
+                of the file
+            layers (slice or list of int, optional): only read these layers
+            lazy (bool): defer reading the values until they are accessed
+            dtype (np.dtype, optional): type the values are converted to when
+                they are read, e.g. np.float32 to halve the memory of float64
+                data. Defaults to the type in the file.
         """
-        if not path and not buffer:
+        if not path and buffer is None:
             raise ValueError("Must supply path or buffer")
-        if buffer:
-            memory = buffer.getvalue()
-            buffer.close()
-            path = tempfile.TemporaryFile()
+        if buffer is not None:
+            if isinstance(buffer, io.BytesIO):
+                memory = buffer.getbuffer()
+            else:
+                memory = memoryview(buffer)
+            path = "memory.nc"
         else:
             memory = None
-
-        with Dataset(path, memory=memory) as nc:
-            keys = list(nc.variables.keys())
-            self.x = nc.variables[keys[0]][:].filled()
-            self.y = nc.variables[keys[1]][:].filled()
-            self.layers = nc.variables[keys[2]][:].filled()
-            self.values = nc.variables[keys[3]][:].filled()
+        self._source = (path, memory)
+
+        with self._open() as nc:
+            data = self._data_variable(nc, variable)
+            self._variable = data.name
+            coordinates = []
+            for dimension in data.dimensions:
+                if dimension not in nc.variables:
+                    raise ValueError(f"No coordinate variable for {dimension}")
+                coordinates.append(nc.variables[dimension][:].filled())
+            self.x = coordinates[-1]
+            self.y = coordinates[-2]
+            self.layers = coordinates[0] if data.ndim == 3 else np.array([None])
             self.crs = nc.crs
 
-        if np.sign(np.diff(self.y).mean()) > 0:
-            self.values = np.flip(self.values, axis=1)
+        if layers is None:
+            layers = slice(None)
+        self.layers = self.layers[layers]
+
+        xs = self._window(self.x, extent, "x")
+        ys = self._window(self.y, extent, "y")
+        self.x = self.x[xs]
+        self.y = self.y[ys]
+        self._index = (layers, ys, xs) if data.ndim == 3 else (ys, xs)
+        self._flip = bool(np.sign(np.diff(self.y).mean()) > 0)
+        self._values = None
+        self._dtype = dtype
+        self._key = None
+
+        if self._flip:
             self.y = np.flip(self.y)
 
         if self.layers.dtype == np.float64 and self.layers.mean() > 1e9:
@@ -118,8 +187,65 @@ class Raster:
             "ymax": round(self.y.max() + self.resolution["y"] / 2, 8),
         }
 
+        if not lazy:
+            self.load()
+
+    def _open(self):
+        path, memory = self._source
+        return Dataset(path, memory=memory)
+
+    @staticmethod
+    def _data_variable(nc, variable: str = None):
+        if variable:
+            return nc.variables[variable]
+        for v in nc.variables.values():
+            if v.ndim >= 2 and v.name not in nc.dimensions:
+                return v
+        raise ValueError("No variable with 2 or more dimensions found")
+
+    @staticmethod
+    def _window(coordinates, extent: dict, axis: str) -> slice:
+        """Slice of the cells of a coordinate intersecting an extent"""
+        if not extent or len(coordinates) < 2:
+            return slice(None)
+        half = np.abs(np.diff(coordinates).mean()) / 2
+        inside = np.nonzero(
+            (coordinates + half > extent[f"{axis}min"])
+            & (coordinates - half < extent[f"{axis}max"])
+        )[0]
+        if not len(inside):
+            raise ValueError(f"extent does not intersect the {axis} coordinates")
+        return slice(inside[0], inside[-1] + 1)
+
+    def load(self):
+        """Read the values from the source, if they haven't been read yet"""
+        if self._values is None:
+            with self._open() as nc:
+                values = nc.variables[self._variable][self._index].filled()
+            if self._flip:
+                values = np.flip(values, axis=-2)
+            if self._dtype is not None:
+                values = values.astype(self._dtype, copy=False)
+            self._values = values
+        return self
+
+    @property
+    def values(self):
+        """Array of shape (layers, y, x), read on first access if lazy"""
+        return self.load()._values
+
+    @values.setter
+    def values(self, values):
+        self._values = values
+
     def copy(self):
-        return copy.copy(self)
+        return self._like(self.values.copy())
+
+    def _like(self, values):
+        """Raster on the same grid holding values, without copying them"""
+        y = copy.copy(self)
+        y._values = values
+        return y
 
     def _mercator(self, y):
         return np.arcsinh(np.tan(y * np.pi / 180)) * 180 / np.pi
@@ -178,14 +304,45 @@ class Raster:
 
         return path
 
+    def tiles(self, *args, **kwargs):
+        """Renderer of XYZ web map tiles of this raster
+
+        Args:
+            *args, **kwargs: passed to tiles.TileRenderer
+        """
+        from tiles import TileRenderer
+
+        return TileRenderer(self, *args, **kwargs)
+
     def sum(self, axis: int = 0):
         """Sum values over given axis"""
-        self.values = self.values.sum(axis=axis)
-        self.layers = [None]
-        return self.copy()
+        y = self._like(self.values.sum(axis=axis))
+        y.layers = [None]
+        y._key = None
+        return y
+
+    def astype(self, dtype):
+        """Copy of the raster with values cast to dtype"""
+        return self._like(self.values.astype(dtype))
+
+    @property
+    def grid_key(self):
+        """Hashable summary of the grid, computed once per raster"""
+        if self._key is None:
+            self._key = (
+                tuple(self.extent.items()),
+                tuple(self.resolution.items()),
+                hash(np.ascontiguousarray(self.x).tobytes()),
+                hash(np.ascontiguousarray(self.y).tobytes()),
+                len(self.layers),
+                self.crs,
+            )
+        return self._key
 
     def _validate_raster_attributes(self, x):
         """Ensure cell-by-cell operations are valid"""
+        if self is x or self.grid_key == x.grid_key:
+            return
         if self.extent != x.extent:
             raise ValueError("Extents do not match.")
         if self.resolution != x.resolution:
@@ -199,55 +356,93 @@ class Raster:
         if self.crs != x.crs:
             raise ValueError("crs attributes do not match.")
 
-    def __add__(self, x):
-        y = self.copy()
+    def __array_ufunc__(self, ufunc, method, *inputs, out=None, **kwargs):
+        """Apply NumPy ufuncs to the values of rasters
+
+        Raster inputs must share the grid of this raster. Results with the
+        shape of the values are returned as rasters, and rasters passed as
+        out have their values written in place, e.g. np.add(a, b, out=a).
+        """
+        for x in inputs + (out or ()):
+            if isinstance(x, Raster):
+                self._validate_raster_attributes(x)
+        args = [x.values if isinstance(x, Raster) else x for x in inputs]
+        if out is not None:
+            kwargs["out"] = tuple(x.values if isinstance(x, Raster) else x for x in out)
+
+        results = getattr(ufunc, method)(*args, **kwargs)
+        if method == "at":
+            return None
+        if ufunc.nout == 1:
+            results = (results,)
+            outputs = out or (None,)
+        else:
+            outputs = out or (None,) * ufunc.nout
+
+        wrapped = []
+        for result, output in zip(results, outputs):
+            if isinstance(output, Raster):
+                wrapped.append(output)
+            elif (
+                output is None
+                and isinstance(result, np.ndarray)
+                and result.shape == self.values.shape
+            ):
+                wrapped.append(self._like(result))
+            else:
+                wrapped.append(result)
+        return wrapped[0] if ufunc.nout == 1 else tuple(wrapped)
+
+    def _inplace(self, ufunc, x):
+        """Apply ufunc in place, upcasting values that can't hold the result
+
+        e.g. r /= 2 or r += 0.5 on an integer raster replace its values with
+        the float result, as NumPy can't write it into the integer array.
+        """
+        other = x.values if isinstance(x, Raster) else x
+        operands = (self.values, other) + ((1.0,) if ufunc is np.true_divide else ())
+        if np.can_cast(np.result_type(*operands), self.values.dtype, "same_kind"):
+            return ufunc(self, x, out=(self,))
         if isinstance(x, Raster):
             self._validate_raster_attributes(x)
-            y.values = y.values + x.values
-            return y
-        else:
-            y.values = y.values + x
-            return y
+        self.values = ufunc(self.values, other)
+        return self
+
+    def __add__(self, x):
+        return np.add(self, x)
+
+    def __radd__(self, x):
+        return np.add(x, self)
+
+    def __iadd__(self, x):
+        return self._inplace(np.add, x)
 
     def __sub__(self, x):
-        y = self.copy()
-        if isinstance(x, Raster):
-            self._validate_raster_attributes(x)
-            y.values = y.values - x.values
-            return y
-        else:
-            y.values = y.values - x
-            return y
+        return np.subtract(self, x)
+
+    def __rsub__(self, x):
+        return np.subtract(x, self)
+
+    def __isub__(self, x):
+        return self._inplace(np.subtract, x)
 
     def __mul__(self, x):
-        y = self.copy()
-        if isinstance(x, Raster):
-            self._validate_raster_attributes(x)
-            y.values = y.values * x.values
-            return y
-        else:
-            y.values = y.values * x
-            return y
+        return np.multiply(self, x)
+
+    def __rmul__(self, x):
+        return np.multiply(x, self)
+
+    def __imul__(self, x):
+        return self._inplace(np.multiply, x)
 
     def __truediv__(self, x):
-        y = self.copy()
-        if isinstance(x, Raster):
-            self._validate_raster_attributes(x)
-            y.values = y.values / x.values
-            return y
-        else:
-            y.values = y.values / x
-            return y
+        return np.true_divide(self, x)
 
     def __rtruediv__(self, x):
-        y = self.copy()
-        if isinstance(x, Raster):
-            self._validate_raster_attributes(x)
-            y.values = x.values / y.values
-            return y
-        else:
-            y.values = x / y.values
-            return y
+        return np.true_divide(x, self)
+
+    def __itruediv__(self, x):
+        return self._inplace(np.true_divide, x)
 
     def __repr__(self):
         return textwrap.dedent(
@@ -0,0 +1,139 @@
+"""Columnar store of evaluation results
+
+Each run appends its station rows to a Parquet dataset, partitioned by the
+date of the valid time (date=YYYY-MM-DD directories). Every run is written to
+its own file, named after its region, valid time and lead time, so reruns and
+backfills replace their previous results instead of duplicating them, and
+concurrent runs never write to the same file.
+"""
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+SCHEMA = pa.schema(
+    [
+        ("time", pa.timestamp("s", tz="UTC")),
+        ("region", pa.string()),
+        ("lead", pa.int16()),
+        ("STID", pa.string()),
+        ("LAT", pa.float64()),
+        ("LON", pa.float64()),
+        ("MW_ws", pa.float32()),
+        ("MW_wd", pa.float32()),
+        ("HRRR_ws", pa.float32()),
+        ("HRRR_wd", pa.float32()),
+        ("wsdiff", pa.float32()),
+        ("wddiff", pa.float32()),
+    ]
+)
+
+PARTITIONING = ds.partitioning(pa.schema([("date", pa.string())]), flavor="hive")
+
+
+class ResultStore:
+    def __init__(self, path: str):
+        """Parquet dataset of evaluation results
+
+        Args:
+            path (str): root directory of the dataset
+        """
+        self.path = path
+
+    def append(self, table: pd.DataFrame, time, region: str = "slc", lead: int = 0):
+        """Write the station rows of one run
+
+        Args:
+            table (pd.DataFrame): comparison table with the columns of SCHEMA
+                other than time, region and lead
+            time (datetime): valid time of the run, in UTC
+            region (str): name of the evaluated region
+            lead (int): forecast lead time in hours
+
+        Returns:
+            str: path of the file written
+        """
+        time = pd.Timestamp(time)
+        time = (
+            time.tz_localize("UTC") if time.tzinfo is None else time.tz_convert("UTC")
+        )
+        table = table.assign(time=time, region=region, lead=lead)
+        for name in SCHEMA.names:
+            if name not in table:
+                table[name] = None
+        arrow = pa.Table.from_pandas(table[SCHEMA.names], SCHEMA, preserve_index=False)
+
+        directory = os.path.join(self.path, f"date={time:%Y-%m-%d}")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{region}_{time:%Y%m%d%H}_f{lead:02}.parquet")
+        tmp = os.path.join(directory, f".{os.path.basename(path)}.{os.getpid()}.tmp")
+        pq.write_table(arrow, tmp, compression="zstd")
+        os.replace(tmp, path)
+        return path
+
+    def dataset(self):
+        """The pyarrow dataset, for queries not covered by query()"""
+        return ds.dataset(
+            self.path,
+            schema=SCHEMA.append(pa.field("date", pa.string())),
+            format="parquet",
+            partitioning=PARTITIONING,
+        )
+
+    def query(
+        self,
+        start=None,
+        end=None,
+        stations=None,
+        regions=None,
+        leads=None,
+        columns=None,
+    ) -> pd.DataFrame:
+        """Load a slice of the results
+
+        The filters are pushed down to the dataset, so only the partitions
+        of the requested dates are listed, and only the matching row groups
+        and columns are read.
+
+        Args:
+            start (datetime, optional): first valid time, in UTC
+            end (datetime, optional): last valid time, in UTC
+            stations (list, optional): STIDs to load
+            regions (list, optional): regions to load
+            leads (list, optional): lead times to load
+            columns (list, optional): columns to load. Defaults to all columns.
+
+        Returns:
+            pd.DataFrame: matching rows
+        """
+        if not os.path.isdir(self.path):
+            return SCHEMA.empty_table().to_pandas()
+
+        filters = []
+        if start is not None:
+            start = pd.Timestamp(start)
+            start = start.tz_localize("UTC") if start.tzinfo is None else start
+            filters.append(ds.field("date") >= f"{start.tz_convert('UTC'):%Y-%m-%d}")
+            filters.append(ds.field("time") >= start)
+        if end is not None:
+            end = pd.Timestamp(end)
+            end = end.tz_localize("UTC") if end.tzinfo is None else end
+            filters.append(ds.field("date") <= f"{end.tz_convert('UTC'):%Y-%m-%d}")
+            filters.append(ds.field("time") <= end)
+        if stations is not None:
+            filters.append(ds.field("STID").isin(list(stations)))
+        if regions is not None:
+            filters.append(ds.field("region").isin(list(regions)))
+        if leads is not None:
+            filters.append(ds.field("lead").isin([int(lead) for lead in leads]))
+
+        expression = None
+        for f in filters:
+            expression = f if expression is None else expression & f
+
+        table = self.dataset().to_table(
+            columns=columns or SCHEMA.names, filter=expression
+        )
+        return table.to_pandas()
@@ -0,0 +1,365 @@
+"""Incremental verification statistics
+
+Running statistics of the wind speed and direction errors are kept in a
+SQLite database, grouped by region, lead time, day and either station, hour
+of day or the whole region. Each run only adds its own rows to the running
+sums, and statistics over any range of days are combined from the daily
+accumulators when they are queried, so rolling model skill never requires
+rescanning the history of results.
+
+Each group stores its count, mean, sum of squared differences from the mean
+(M2, as in Welford's algorithm) and sum of absolute errors. Accumulators are
+merged with the parallel form of Welford's update (Chan et al.), which is
+exact for any split of the data.
+
+The accumulators of each run are also kept, so that when an hour is evaluated
+again (e.g. once late observations arrive) its previous contribution is taken
+out of the daily accumulators before the new one is added.
+"""
+import os
+import sqlite3
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+
+# Grouping of the statistics, and the column of the comparison table giving
+# the key of each row
+SCOPES = ("station", "hour", "region")
+
+# Errors accumulated for each group. Wind speed errors are signed (HRRR minus
+# MesoWest) so that the bias can be reported, wind direction errors are the
+# absolute difference from the comparison table.
+VARIABLES = ("ws", "wd")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stats (
+    region TEXT NOT NULL,
+    lead INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    key TEXT NOT NULL,
+    variable TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    mean REAL NOT NULL,
+    m2 REAL NOT NULL,
+    abs_sum REAL NOT NULL,
+    PRIMARY KEY (region, lead, scope, key, variable, date)
+);
+CREATE INDEX IF NOT EXISTS stats_date ON stats (scope, date);
+CREATE TABLE IF NOT EXISTS runs (
+    region TEXT NOT NULL,
+    lead INTEGER NOT NULL,
+    time TEXT NOT NULL,
+    PRIMARY KEY (region, lead, time)
+);
+CREATE TABLE IF NOT EXISTS run_stats (
+    region TEXT NOT NULL,
+    lead INTEGER NOT NULL,
+    time TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    key TEXT NOT NULL,
+    variable TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    mean REAL NOT NULL,
+    m2 REAL NOT NULL,
+    abs_sum REAL NOT NULL,
+    PRIMARY KEY (region, lead, time, scope, key, variable)
+);
+"""
+
+STATS_COLUMNS = ["n", "mean", "m2", "abs_sum"]
+
+
+def _moments(errors: pd.DataFrame, keys):
+    """Count, mean, M2 and absolute sum of the error column of each group"""
+    mean = errors.groupby(keys, sort=False)["error"].transform("mean")
+    errors = errors.assign(
+        deviation=(errors["error"] - mean) ** 2, absolute=errors["error"].abs()
+    )
+    moments = errors.groupby(keys, sort=False).agg(
+        n=("error", "count"),
+        mean=("error", "mean"),
+        m2=("deviation", "sum"),
+        abs_sum=("absolute", "sum"),
+    )
+    return moments.reset_index()
+
+
+def combine(n_a, mean_a, m2_a, n_b, mean_b, m2_b):
+    """Merge two sets of Welford accumulators
+
+    Args:
+        n_a, mean_a, m2_a: count, mean and M2 of the first set
+        n_b, mean_b, m2_b: count, mean and M2 of the second set
+
+    Returns:
+        tuple: (n, mean, m2) of the union of both sets
+    """
+    n = n_a + n_b
+    with np.errstate(invalid="ignore", divide="ignore"):
+        delta = mean_b - mean_a
+        mean = np.where(n > 0, mean_a + delta * n_b / n, 0.0)
+        m2 = np.where(n > 0, m2_a + m2_b + delta**2 * n_a * n_b / n, 0.0)
+    return n, mean, m2
+
+
+def remove(n, mean, m2, n_b, mean_b, m2_b):
+    """Take a set of Welford accumulators back out of a merged set
+
+    The inverse of combine: given the union of two sets and the second set,
+    returns the accumulators of the first.
+
+    Args:
+        n, mean, m2: count, mean and M2 of the union
+        n_b, mean_b, m2_b: count, mean and M2 of the set to remove
+
+    Returns:
+        tuple: (n, mean, m2) of the remaining set
+    """
+    n_a = n - n_b
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_a = np.where(n_a > 0, (n * mean - n_b * mean_b) / n_a, 0.0)
+        delta = mean_b - mean_a
+        m2_a = np.where(n_a > 0, m2 - m2_b - delta**2 * n_a * n_b / n, 0.0)
+    return n_a, mean_a, np.maximum(m2_a, 0.0)
+
+
+class StatsStore:
+    def __init__(self, path: str):
+        """SQLite database of running verification statistics
+
+        Args:
+            path (str): database file, created if it doesn't exist
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    def _connect(self):
+        # Backfill workers update the database concurrently, so wait for the
+        # write lock rather than failing
+        return closing(sqlite3.connect(self.path, timeout=60, isolation_level=None))
+
+    def update(self, table: pd.DataFrame, time, region: str = "slc", lead: int = 0):
+        """Add the errors of one run to the running statistics
+
+        If the run, identified by its region, lead time and valid time, was
+        already added, its previous errors are replaced so that reruns don't
+        count twice.
+
+        Args:
+            table (pd.DataFrame): comparison table with STID, MW_ws, HRRR_ws
+                and wddiff columns
+            time (datetime): valid time of the run, in UTC
+            region (str): name of the evaluated region
+            lead (int): forecast lead time in hours
+
+        Returns:
+            bool: whether an earlier run was replaced
+        """
+        time = pd.Timestamp(time)
+        time = (
+            time.tz_localize("UTC") if time.tzinfo is None else time.tz_convert("UTC")
+        )
+
+        errors = pd.concat(
+            [
+                pd.DataFrame(
+                    {
+                        "variable": variable,
+                        "station": table["STID"].astype(str).to_numpy(),
+                        "error": np.asarray(error, dtype=float),
+                    }
+                )
+                for variable, error in (
+                    ("ws", table["HRRR_ws"] - table["MW_ws"]),
+                    ("wd", table["wddiff"]),
+                )
+            ]
+        ).dropna(subset=["error"])
+        errors["hour"] = f"{time:%H}"
+        errors["region"] = "all"
+
+        rows = []
+        for scope in SCOPES:
+            moments = _moments(errors, ["variable", scope]).rename(
+                columns={scope: "key"}
+            )
+            moments["scope"] = scope
+            rows.append(moments)
+        rows = pd.concat(rows)
+        rows["region"] = region
+        rows["lead"] = int(lead)
+        rows["date"] = date = f"{time:%Y-%m-%d}"
+        columns = ["region", "lead", "date", "scope", "key", "variable"]
+        rows = rows[columns + STATS_COLUMNS]
+        run = (region, int(lead), time.isoformat())
+        partition = (region, int(lead), date)
+        keys = ["scope", "key", "variable"]
+
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                recorded = db.execute(
+                    "SELECT 1 FROM runs WHERE region = ? AND lead = ? AND time = ?",
+                    run,
+                ).fetchone()
+                if recorded is not None:
+                    previous = pd.DataFrame(
+                        db.execute(
+                            "SELECT scope, key, variable, n, mean, m2, abs_sum"
+                            " FROM run_stats WHERE region = ? AND lead = ?"
+                            " AND time = ?",
+                            run,
+                        ).fetchall(),
+                        columns=keys + STATS_COLUMNS,
+                    )
+                    self._merge(db, previous, columns, partition, subtract=True)
+                    db.execute(
+                        "DELETE FROM run_stats WHERE region = ? AND lead = ?"
+                        " AND time = ?",
+                        run,
+                    )
+                else:
+                    db.execute("INSERT INTO runs VALUES (?, ?, ?)", run)
+
+                self._merge(db, rows[keys + STATS_COLUMNS], columns, partition)
+                db.executemany(
+                    "INSERT INTO run_stats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        run + row
+                        for row in rows[keys + STATS_COLUMNS]
+                        .astype({"n": int})
+                        .itertuples(index=False, name=None)
+                    ),
+                )
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return recorded is not None
+
+    @staticmethod
+    def _merge(db, rows, columns, partition, subtract=False):
+        """Add the accumulators of a run to, or take them out of, a day"""
+        old = pd.DataFrame(
+            db.execute(
+                "SELECT * FROM stats WHERE region = ? AND lead = ? AND date = ?",
+                partition,
+            ).fetchall(),
+            columns=columns + STATS_COLUMNS,
+        )
+        rows = rows.assign(region=partition[0], lead=partition[1], date=partition[2])
+        merged = rows.merge(old, on=columns, how="left", suffixes=("", "_old"))
+        merged = merged.fillna(
+            {"n_old": 0, "mean_old": 0.0, "m2_old": 0.0, "abs_sum_old": 0.0}
+        )
+        accumulators = (
+            merged["n_old"].to_numpy(),
+            merged["mean_old"].to_numpy(),
+            merged["m2_old"].to_numpy(),
+            merged["n"].to_numpy(),
+            merged["mean"].to_numpy(),
+            merged["m2"].to_numpy(),
+        )
+        if subtract:
+            merged["abs_sum"] = merged["abs_sum_old"] - merged["abs_sum"]
+            merged["n"], merged["mean"], merged["m2"] = remove(*accumulators)
+        else:
+            merged["abs_sum"] += merged["abs_sum_old"]
+            merged["n"], merged["mean"], merged["m2"] = combine(*accumulators)
+
+        empty = merged["n"] <= 0
+        db.executemany(
+            "DELETE FROM stats WHERE region = ? AND lead = ? AND date = ?"
+            " AND scope = ? AND key = ? AND variable = ?",
+            merged.loc[empty, columns]
+            .astype({"lead": int})
+            .itertuples(index=False, name=None),
+        )
+        db.executemany(
+            "INSERT OR REPLACE INTO stats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            merged.loc[~empty, columns + STATS_COLUMNS]
+            .astype({"lead": int, "n": int})
+            .itertuples(index=False, name=None),
+        )
+
+    def query(
+        self,
+        scope: str = "station",
+        variable: str = "ws",
+        start=None,
+        end=None,
+        regions=None,
+        leads=None,
+    ) -> pd.DataFrame:
+        """Verification statistics over a range of days
+
+        Args:
+            scope (str): "station", "hour" (of day) or "region"
+            variable (str): "ws" for wind speed or "wd" for wind direction
+            start (date, optional): first day, inclusive
+            end (date, optional): last day, inclusive
+            regions (list, optional): regions to include
+            leads (list, optional): lead times to include
+
+        Returns:
+            pd.DataFrame: n, bias, mae, rmse and std of each region, lead
+                time and key
+        """
+        if scope not in SCOPES:
+            raise ValueError(f"scope must be one of {SCOPES}")
+        if variable not in VARIABLES:
+            raise ValueError(f"variable must be one of {VARIABLES}")
+
+        sql = "SELECT region, lead, key, n, mean, m2, abs_sum FROM stats"
+        sql += " WHERE scope = ? AND variable = ?"
+        params = [scope, variable]
+        if start is not None:
+            sql += " AND date >= ?"
+            params.append(f"{pd.Timestamp(start):%Y-%m-%d}")
+        if end is not None:
+            sql += " AND date <= ?"
+            params.append(f"{pd.Timestamp(end):%Y-%m-%d}")
+        if regions is not None:
+            sql += f" AND region IN ({','.join('?' * len(regions))})"
+            params += list(regions)
+        if leads is not None:
+            sql += f" AND lead IN ({','.join('?' * len(leads))})"
+            params += [int(lead) for lead in leads]
+
+        with self._connect() as db:
+            days = pd.DataFrame(
+                db.execute(sql, params).fetchall(),
+                columns=["region", "lead", "key", "n", "mean", "m2", "abs_sum"],
+            )
+
+        # Merge the daily accumulators of each group with combine(), one day of
+        # every group at a time
+        groups = days.groupby(["region", "lead", "key"])
+        group = groups.ngroup().to_numpy()
+        day = groups.cumcount().to_numpy()
+        n, mean, m2 = np.zeros((3, groups.ngroups))
+        for d in range(day.max() + 1 if len(days) else 0):
+            rows = day == d
+            g = group[rows]
+            n[g], mean[g], m2[g] = combine(
+                n[g],
+                mean[g],
+                m2[g],
+                days["n"].to_numpy()[rows],
+                days["mean"].to_numpy()[rows],
+                days["m2"].to_numpy()[rows],
+            )
+
+        stats = pd.DataFrame(index=groups.size().index)
+        stats["n"] = n.astype(int)
+        stats["bias"] = mean
+        stats["mae"] = groups["abs_sum"].sum() / n
+        stats["rmse"] = np.sqrt(m2 / n + mean**2)
+        stats["std"] = np.sqrt(m2 / n)
+        return stats.reset_index()
@@ -0,0 +1,209 @@
+"""XYZ web map tiles of Raster data
+
+A TileRenderer builds a pyramid of overviews of a raster, each half the
+resolution of the previous one, and renders 256 x 256 PNG tiles in the Web
+Mercator XYZ scheme used by Leaflet and other web maps. Each tile is sampled
+from the overview closest to its own resolution and colored with a NumPy
+lookup table, so rendering a tile touches at most a few tile sized arrays.
+PNGs are encoded directly with zlib, and optionally cached on disk.
+"""
+import hashlib
+import os
+import struct
+import zlib
+
+import numpy as np
+
+TILE_SIZE = 256
+
+# Colors evenly spaced along each colormap, interpolated to 256 entries
+COLORMAPS = {
+    "viridis": ["#440154", "#3b528b", "#21918c", "#5ec962", "#fde725"],
+    "magma": ["#000004", "#51127c", "#b73779", "#fc8961", "#fcfdbf"],
+    "RdBu": ["#67001f", "#d6604d", "#f7f7f7", "#4393c3", "#053061"],
+}
+
+
+def colormap(name: str = "viridis", n: int = 256) -> np.ndarray:
+    """Lookup table of n RGBA colors
+
+    Args:
+        name (str): one of COLORMAPS
+        n (int): number of colors
+
+    Returns:
+        np.ndarray: (n, 4) uint8 array
+    """
+    anchors = np.array(
+        [[int(c[i : i + 2], 16) for i in (1, 3, 5)] for c in COLORMAPS[name]],
+        dtype=float,
+    )
+    positions = np.linspace(0, 1, len(anchors))
+    steps = np.linspace(0, 1, n)
+    table = np.empty((n, 4), dtype=np.uint8)
+    for channel in range(3):
+        table[:, channel] = np.rint(np.interp(steps, positions, anchors[:, channel]))
+    table[:, 3] = 255
+    return table
+
+
+def encode_png(rgba: np.ndarray) -> bytes:
+    """Encode an (height, width, 4) uint8 array as a PNG"""
+    height, width, _ = rgba.shape
+    # Every scanline is prefixed with filter type 0 (none)
+    scanlines = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+    scanlines[:, 1:] = rgba.reshape(height, width * 4)
+
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+    return b"".join(
+        [
+            b"\x89PNG\r\n\x1a\n",
+            chunk(b"IHDR", header),
+            chunk(b"IDAT", zlib.compress(scanlines.tobytes(), 6)),
+            chunk(b"IEND", b""),
+        ]
+    )
+
+
+def _downsample(image: np.ndarray) -> np.ndarray:
+    """Mean of each 2 x 2 block of cells, ignoring NaNs"""
+    height, width = image.shape
+    padded = np.full((height + height % 2, width + width % 2), np.nan)
+    padded[:height, :width] = image
+    blocks = padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2)
+    valid = ~np.isnan(blocks)
+    count = valid.sum(axis=(1, 3))
+    total = np.where(valid, blocks, 0).sum(axis=(1, 3))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(count > 0, total / count, np.nan)
+
+
+def tile_bounds(z: int, x: int, y: int):
+    """Longitudes and latitudes of the pixel centers of an XYZ tile"""
+    n = TILE_SIZE * 2**z
+    pixels = np.arange(TILE_SIZE) + 0.5
+    lon = (x * TILE_SIZE + pixels) / n * 360 - 180
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y * TILE_SIZE + pixels) / n))))
+    return lon, lat
+
+
+class TileRenderer:
+    def __init__(
+        self,
+        raster,
+        log10: bool = False,
+        vmin: float = None,
+        vmax: float = None,
+        cmap: str = "viridis",
+        cache: str = None,
+        name: str = None,
+    ):
+        """Render XYZ PNG tiles of a raster in longitude, latitude coordinates
+
+        If the raster is 3 dimensional, the layers axis is summed. As in
+        Raster.plot, cells equal to 0 or below vmin are transparent.
+
+        Args:
+            raster (raster.Raster): data to render
+            log10 (bool): log10 transform values prior to rendering
+            vmin (float, optional): value of the first color. Defaults to the
+                minimum of the data.
+            vmax (float, optional): value of the last color. Defaults to the
+                maximum of the data.
+            cmap (str): one of COLORMAPS
+            cache (str, optional): directory rendered tiles are cached in
+            name (str, optional): cache key of the rendered data. Defaults to
+                a hash of the data and rendering options.
+        """
+        image = np.asarray(raster.values, dtype=float)
+        while len(image.shape) > 2:
+            image = image.sum(axis=0)
+        image = np.where(image == 0, np.nan, image)
+        if log10:
+            with np.errstate(invalid="ignore", divide="ignore"):
+                image = np.log10(image)
+            image[np.isinf(image)] = np.nan
+        if vmin is not None:
+            image[image < vmin] = np.nan
+
+        finite = image[np.isfinite(image)]
+        self.vmin = vmin if vmin is not None else (finite.min() if finite.size else 0)
+        self.vmax = vmax if vmax is not None else (finite.max() if finite.size else 1)
+        self.colors = colormap(cmap)
+        self.extent = raster.extent
+        self.resolution = raster.resolution
+
+        # Overviews, from full resolution until the whole raster fits in a tile
+        self.levels = [image]
+        while max(self.levels[-1].shape) > TILE_SIZE:
+            self.levels.append(_downsample(self.levels[-1]))
+
+        self.cache = cache
+        if cache and name is None:
+            digest = hashlib.sha1(np.ascontiguousarray(image).tobytes())
+            digest.update(repr((self.extent, self.vmin, self.vmax, cmap)).encode())
+            name = digest.hexdigest()[:16]
+        self.name = name
+
+    def _level(self, z: int) -> int:
+        """Coarsest overview that is at least as fine as the tile's pixels"""
+        pixel = 360 / (TILE_SIZE * 2**z)
+        level = int(np.floor(np.log2(pixel / self.resolution["x"])))
+        return min(max(level, 0), len(self.levels) - 1)
+
+    def render(self, z: int, x: int, y: int) -> np.ndarray:
+        """RGBA pixels of a tile, transparent outside of the raster
+
+        Returns:
+            np.ndarray: (256, 256, 4) uint8 array
+        """
+        level = self._level(z)
+        image = self.levels[level]
+        scale = 2**level
+        lon, lat = tile_bounds(z, x, y)
+
+        # Values rows run north to south, see Raster
+        cols = np.floor(
+            (lon - self.extent["xmin"]) / (self.resolution["x"] * scale)
+        ).astype(np.intp)
+        rows = np.floor(
+            (self.extent["ymax"] - lat) / (self.resolution["y"] * scale)
+        ).astype(np.intp)
+        col_ok = (cols >= 0) & (cols < image.shape[1])
+        row_ok = (rows >= 0) & (rows < image.shape[0])
+
+        values = np.full((TILE_SIZE, TILE_SIZE), np.nan)
+        if col_ok.any() and row_ok.any():
+            values[np.ix_(row_ok, col_ok)] = image[np.ix_(rows[row_ok], cols[col_ok])]
+
+        span = self.vmax - self.vmin or 1
+        index = (values - self.vmin) / span * (len(self.colors) - 1)
+        index = np.clip(np.nan_to_num(index), 0, len(self.colors) - 1)
+        rgba = self.colors[index.astype(np.intp)]
+        rgba[np.isnan(values), 3] = 0
+        return rgba
+
+    def tile(self, z: int, x: int, y: int) -> bytes:
+        """PNG of a tile, from the cache if it has already been rendered"""
+        path = None
+        if self.cache:
+            path = os.path.join(self.cache, self.name, str(z), str(x), f"{y}.png")
+            try:
+                with open(path, "rb") as f:
+                    return f.read()
+            except FileNotFoundError:
+                pass
+
+        png = encode_png(self.render(z, x, y))
+
+        if path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(png)
+            os.replace(tmp, path)
+        return png
@@ -0,0 +1,173 @@
+"""Evaluation of HRRR cycles as soon as they land in a bucket
+
+A CycleWatcher polls the date folders of a bucket prefix for new
+hysplit.tHHz.hrrrf files and hands each new cycle to a handler running in the
+same, warm, process. Cycles wait in a bounded queue, so a backlog never grows
+without limit, and the generation of each file that was handled is recorded
+in a state file, so cycles are only evaluated once across restarts, and again
+if their file is rewritten.
+"""
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+CYCLE_FILE = re.compile(r"(\d{8})/hysplit\.t(\d{2})z\.hrrrf$")
+
+
+class CycleWatcher:
+    def __init__(
+        self,
+        bucket,
+        prefix: str,
+        handler,
+        state: str,
+        poll: float = 60,
+        days: int = 2,
+        queue_size: int = 4,
+        retries: int = 3,
+    ):
+        """Watch a bucket prefix for new HRRR cycle files
+
+        Args:
+            bucket (GoogleCloudStorage.GoogleCloudStorageBucket): bucket to poll
+            prefix (str): folder holding the YYYYMMDD date folders, e.g.
+                "-112.6_-111.4_40.0_41.3/"
+            handler (callable): called with the start of each new cycle, as a
+                naive datetime in UTC
+            state (str): JSON file recording the cycles that were handled
+            poll (float): seconds between listings of the bucket
+            days (int): number of most recent date folders listed on each poll
+            queue_size (int): maximum number of cycles waiting to be handled
+            retries (int): attempts at a cycle before it is skipped
+        """
+        self.bucket = bucket
+        self.prefix = prefix
+        self.handler = handler
+        self.state = state
+        self.poll = poll
+        self.days = days
+        self.retries = retries
+        self.queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._failures = {}
+        self._done = {}
+        if os.path.exists(state):
+            with open(state) as f:
+                self._done = json.load(f)
+
+    def _save(self):
+        tmp = f"{self.state}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self._done, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.state)
+
+    def new_cycles(self, now: datetime = None):
+        """Cycle files in the most recent date folders that haven't been handled
+
+        Only the names and generations of the objects are requested, so a poll
+        is a couple of small listing calls.
+
+        Returns:
+            list of tuples: (cycle, name, generation), oldest first
+        """
+        now = now or datetime.utcnow()
+        found = []
+        for day in range(self.days):
+            prefix = f"{self.prefix}{now - timedelta(days=day):%Y%m%d}/"
+            for blob in self.bucket.ls(prefix, fields="items(name,generation)"):
+                match = CYCLE_FILE.search(blob.name)
+                if not match:
+                    continue
+                generation = str(blob.generation)
+                with self._lock:
+                    if (
+                        self._done.get(blob.name) == generation
+                        or blob.name in self._pending
+                        or self._failures.get((blob.name, generation), 0)
+                        >= self.retries
+                    ):
+                        continue
+                cycle = datetime.strptime("".join(match.groups()), "%Y%m%d%H")
+                found.append((cycle, blob.name, generation))
+        return sorted(found)
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            cycle, name, generation = item
+            logger.info(f"Evaluating cycle {cycle:%Y%m%d%H} from {name}")
+            started = time.perf_counter()
+            try:
+                self.handler(cycle)
+            except Exception:
+                logger.exception(f"Cycle {cycle:%Y%m%d%H} failed")
+                with self._lock:
+                    key = (name, generation)
+                    self._failures[key] = self._failures.get(key, 0) + 1
+            else:
+                logger.info(
+                    f"Cycle {cycle:%Y%m%d%H} done in "
+                    f"{time.perf_counter() - started:.1f}s"
+                )
+                with self._lock:
+                    self._done[name] = generation
+                    self._save()
+            finally:
+                with self._lock:
+                    self._pending.discard(name)
+                self.queue.task_done()
+
+    def run(self, workers: int = 1, stop: threading.Event = None):
+        """Poll the bucket and handle new cycles until stop is set
+
+        Args:
+            workers (int): number of cycles handled concurrently
+            stop (threading.Event, optional): ends the watch once set. Cycles
+                already queued are finished first.
+        """
+        stop = stop or threading.Event()
+        threads = [
+            threading.Thread(target=self._work, name=f"cycle-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            while not stop.is_set():
+                try:
+                    cycles = self.new_cycles()
+                except Exception:
+                    logger.exception(f"Listing gs://{self.bucket.bucket_name} failed")
+                    cycles = []
+                for item in cycles:
+                    with self._lock:
+                        self._pending.add(item[1])
+                    # Blocks while the queue is full, so the listing is retried
+                    # once the backlog has been worked through
+                    while not stop.is_set():
+                        try:
+                            self.queue.put(item, timeout=1)
+                            break
+                        except queue.Full:
+                            continue
+                    else:
+                        with self._lock:
+                            self._pending.discard(item[1])
+                        break
+                stop.wait(self.poll)
+        finally:
+            for _ in threads:
+                self.queue.put(None)
+            for thread in threads:
+                thread.join()